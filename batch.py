@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""Runs searches without the ui and writes the results to stdout, one video
+per line, for scripts and cron jobs. Queries are given like the pages of the
+ui show them: 's:term' or just 'term' searches for a term, 'u:user' and
+'u:user/term' search the uploads of a user. --subs adds the uploads of every
+user subscribed to in the session. The exit status is 0 if every query
+succeeded, 1 if any failed and 2 for bad arguments.
+
+examples:
+  python3 batch.py 'cats' u:someuser -n 5
+  python3 batch.py --subs -f tsv < /dev/null
+  cat queries | python3 batch.py - -j 4"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from query import *
+
+fields = ('query', 'id', 'title', 'user', 'uploaded', 'length', 'views', 'rating', 'likes', 'dislikes', 'url')
+
+def parse_query(text):
+    """Returns a (user, term) tuple for a query, user being '' for a search
+    on all videos."""
+
+    if (text.startswith('u:')):
+        user, slash, term = text[2:].partition('/')
+        return (user, term)
+    if (text.startswith('s:')):
+        text = text[2:]
+    return ('', text)
+
+
+def subscribed_users(path):
+    """Returns the users subscribed to in a saved session, or None if there is
+    no session at path. The session is only read, the ui may be using it."""
+
+    import pickle
+    import sqlite3
+    import urllib.parse
+    try:
+        db = sqlite3.connect('file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path)), uri = True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        rows = db.execute("select state from pages where class = 'SubscriptionPage' order by position").fetchall()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        db.close()
+    users = []
+    for state, in rows:
+        users.extend(pickle.loads(state).get('user_list', []))
+    return users
+
+
+def run_query(query, args):
+    user, term = parse_query(query)
+    if (user != ''):
+        return search_user(user, term, args.order or 'published', args.max_results, args.timeout)
+    return search_term(term, args.order or 'relevance', args.max_results, args.timeout)
+
+
+def video_fields(query, video):
+    return {
+        'query': query,
+        'id': video.id,
+        'title': video.title,
+        'user': video.user,
+        'uploaded': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(video.uploaded)),
+        'length': video.length,
+        'views': video.views,
+        'rating': video.rating,
+        'likes': video.likes,
+        'dislikes': video.dislikes,
+        'url': video.url(),
+    }
+
+
+def format_line(values, output):
+    if (output == 'jsonl'):
+        return json.dumps(values, ensure_ascii = False)
+    # tabs and newlines in titles would break the columns
+    return '\t'.join(str(values[field]).replace('\t', ' ').replace('\n', ' ') for field in fields)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0], formatter_class = argparse.RawDescriptionHelpFormatter,
+                                     epilog = __doc__.split('\n\n', 1)[1])
+    parser.add_argument('queries', nargs = '*', help = "queries to run, - reads them from stdin one per line")
+    parser.add_argument('--subs', action = 'store_true', help = 'search the uploads of every subscribed user')
+    parser.add_argument('-n', '--max-results', type = int, default = 20, help = 'results per query (default 20)')
+    parser.add_argument('-o', '--order', help = 'relevance, published, viewCount or rating (default relevance, published for users)')
+    parser.add_argument('-j', '--jobs', type = int, default = 8, help = 'queries run at once (default 8)')
+    parser.add_argument('-f', '--format', choices = ('jsonl', 'tsv'), default = 'jsonl', help = 'output format (default jsonl)')
+    parser.add_argument('--header', action = 'store_true', help = 'start tsv output with a line of column names')
+    parser.add_argument('-t', '--timeout', type = float, default = 10, help = 'seconds to wait on the network per request (default 10)')
+    parser.add_argument('--session', default = 'session.db', help = 'session to read subscriptions from (default session.db)')
+    parser.add_argument('--offline', action = 'store_true', help = 'only use cached responses')
+    parser.add_argument('--api-base', help = 'server to send searches to')
+    args = parser.parse_args(argv)
+
+    queries = []
+    for query in args.queries:
+        if (query == '-'):
+            queries.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            queries.append(query)
+    if (args.subs):
+        users = subscribed_users(args.session) if os.path.isfile(args.session) else None
+        if (users is None):
+            parser.error('no session at ' + args.session)
+        queries.extend('u:' + user for user in users)
+    if (not queries):
+        parser.error('no queries given')
+    if (args.max_results < 1 or args.jobs < 1):
+        parser.error('--max-results and --jobs must be at least 1')
+
+    if (args.api_base):
+        set_api_base(args.api_base)
+    # the same time to live as the ui's defaults
+    cache.configure(cache.max_size, {'user': 300, 'term': 3600}, args.offline)
+    pool.resize(args.jobs)
+
+    if (args.format == 'tsv' and args.header):
+        print('\t'.join(fields))
+    failed = 0
+    with ThreadPoolExecutor(max_workers = args.jobs) as executor:
+        futures = {executor.submit(run_query, query, args): query for query in queries}
+        # results are written as soon as each query is done
+        for future in as_completed(futures):
+            query = futures[future]
+            try:
+                videos = future.result()
+            except Exception as e:
+                failed += 1
+                print('error: ' + query + ': ' + str(e), file = sys.stderr)
+                continue
+            sys.stdout.write(''.join(format_line(video_fields(query, video), args.format) + '\n' for video in videos))
+            sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if (__name__ == '__main__'):
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except BrokenPipeError:
+        # the reader stopped early, like head does
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for yaytp, run against a local fakeserver.py so no network is
+needed. Run with 'python3 bench.py [results.json]', the results are printed
+and written as json to the file if one is given so runs can be compared."""
+
+import json
+import os
+import platform
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from unicodedata import east_asian_width, normalize
+from fakeserver import FakeServer, make_item
+from columns import VideoColumns
+from ui import *
+
+class LegacyVideo():
+    """The Video class as it was before fields were parsed lazily, kept to
+    compare against."""
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.title = data['title']
+        self.description = data['description']
+        self.user = data['uploader']
+        self.uploaded = time.strptime(data['uploaded'].replace(".000Z", "").replace("T", " "), "%Y-%m-%d %H:%M:%S")
+        self.views = int(data['viewCount']) if 'viewCount' in data else 0
+        self.rating = float(data['rating']) if 'rating' in data else 0
+        self.likes = int(data['likeCount']) if 'likeCount' in data else 0
+        self.dislikes = int(data['ratingCount']) - self.likes if 'ratingCount' in data else 0
+        self.comment_count = int(data['commentCount']) if 'commentCount' in data else 0
+        self.length = int(data['duration'])
+
+
+def legacy_get_real_width(str):
+    """get_real_width as it was before the width table."""
+
+    real_width = 0
+    for char in str:
+        real_width += 2 if east_asian_width(char) == 'W' else 1
+    return real_width
+
+
+def legacy_fit_string_split(str, width):
+    """fit_string_split as it was before the width table."""
+
+    real_width = 0
+    index = 0
+    while (index < len(str)):
+        double_width = east_asian_width(str[index]) == 'W'
+        real_width += 2 if double_width else 1
+        if (real_width > width):
+            padding = 0
+            while (str[index] in string.ascii_letters + string.digits  and east_asian_width(str[index]) != 'W'):
+                index -= 1
+                padding += 1
+            if (double_width and real_width - width == 1):
+                return (str[0:index] + ' ' * (padding + 1), str[index + 1:])
+            else:
+                return (str[0:index] + ' ' * (padding) , str[index + 1:])
+        index += 1
+    return (str + ' ' * (width - real_width), '')
+
+
+def bench_video(count = 10000, repeat = 5):
+    """Compares construction time and memory of Video and LegacyVideo."""
+
+    items = [make_item(i) for i in range(count)]
+    texts = [json.dumps(item) for item in items]
+    results = {}
+    for cls in (LegacyVideo, Video):
+        seconds = min(timeit.repeat(lambda: [cls(item) for item in items], number = 1, repeat = repeat))
+        # decode inside the measurement so the memory of items kept for lazy
+        # parsing is counted
+        tracemalloc.start()
+        videos = [cls(json.loads(text)) for text in texts]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del videos
+        results[cls.__name__] = {'construct_us': seconds / count * 1e6, 'bytes_per_video': size / count}
+    return results
+
+
+def bench_width(count = 2000, repeat = 5):
+    """Compares the width functions of format.py with the ones before the width
+    table, on ascii, CJK and decomposed accented titles. fit_string_split is
+    measured with an empty cache and with every title already cached, like on
+    a redraw."""
+
+    titles = {
+        'ascii': ['video number %d with a reasonably long title for testing' % i for i in range(count)],
+        'cjk': ['第%d回 日本語のとても長いタイトル テスト動画 ｆｕｌｌ ｗｉｄｔｈ' % i for i in range(count)],
+        # combining marks take no columns and stay with their word
+        'nfd': [normalize('NFD', 'café résumé naïve %d à la crème brûlée déjà vu' % i) for i in range(count)],
+    }
+    width = 40
+    results = {}
+    for kind, strings in titles.items():
+        per_call = lambda function: min(timeit.repeat(lambda: [function(string) for string in strings], number = 1, repeat = repeat)) / count * 1e6
+        get_real_width('')
+        char_width('a')
+        def cold_fit(string):
+            fit_string_split.cache_clear()
+            return fit_string_split(string, width)
+        results[kind] = {
+            'legacy_width_us': per_call(legacy_get_real_width),
+            'width_cold_us': per_call(get_real_width.__wrapped__),
+            'width_warm_us': per_call(get_real_width),
+            'legacy_fit_us': per_call(lambda string: legacy_fit_string_split(string, width)),
+            'fit_cold_us': per_call(cold_fit),
+            'fit_warm_us': per_call(lambda string: fit_string_split(string, width)),
+        }
+    return results
+
+
+class VirtualScreen():
+    """A stand in for Screen that keeps rows in memory, to draw pages without
+    a terminal."""
+
+    class Window():
+        def __init__(self, h, w):
+            self.size = (h, w)
+
+        def getmaxyx(self):
+            return self.size
+
+    def __init__(self, h, w):
+        self.windows = {'main': VirtualScreen.Window(h, w)}
+        self.rows = {}
+
+    def put(self, name, y, segments):
+        self.rows[(name, y)] = segments
+
+    def clear_rows(self, name, start):
+        for key in [key for key in self.rows if key[0] == name and key[1] >= start]:
+            del self.rows[key]
+
+
+def use_server(server):
+    """Points searches at a fake server, with the response cache, the library
+    and the rate limit turned off so every search is a request sent at once."""
+
+    set_api_base(server.url)
+    cache.configure(0, {}, False)
+    library.enabled = False
+    scheduler.configure(0, 1, 3)
+
+
+def bench_search(count = 50, max_results = 50):
+    """Measures sequential searches against a local server."""
+
+    server = FakeServer().start()
+    use_server(server)
+    search_term('warm up', 'relevance', 1)
+    start = time.perf_counter()
+    videos = 0
+    for i in range(count):
+        videos += len(search_term('term %d' % i, 'relevance', max_results))
+    seconds = time.perf_counter() - start
+    server.stop()
+    return {'search': {'search_ms': seconds / count * 1000, 'videos_per_s': videos / seconds, 'connections': server.connections}}
+
+
+def bench_refresh(users = 100, latency = 0.02, max_results = 20):
+    """Measures a full refresh of a subscription page and a second refresh with
+    nothing new, against a server with latency."""
+
+    server = FakeServer(latency = latency).start()
+    use_server(server)
+    page = SubscriptionPage('subscriptions')
+    for i in range(users):
+        page.add_user('user%d' % i)
+    results = {}
+    for name in ('full', 'incremental'):
+        requests = server.requests
+        start = time.perf_counter()
+        failed = page.refresh_subs(max_results, workers = 8, timeout = 10)
+        results[name] = {'seconds': time.perf_counter() - start, 'requests': server.requests - requests, 'failed': len(failed)}
+    server.stop()
+    return results
+
+
+def bench_scheduler(count = 50, threads = 8, error_rate = 0.3):
+    """Measures identical searches made at once, which should be sent once,
+    and searches against a server failing a fraction of requests, which
+    should succeed after retries."""
+
+    import threading
+    server = FakeServer(latency = 0.05).start()
+    use_server(server)
+    workers = [threading.Thread(target = search_term, args = ('same term', 'relevance', 20)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    server.stop()
+    results = {'identical searches': {'searches': threads, 'requests': server.requests}}
+    server = FakeServer(error_rate = error_rate, seed = 1).start()
+    use_server(server)
+    backoff = scheduler.backoff
+    scheduler.backoff = 0.01
+    failed = 0
+    start = time.perf_counter()
+    for i in range(count):
+        try:
+            search_term('term %d' % i, 'relevance', 20)
+        except OSError:
+            failed += 1
+    seconds = time.perf_counter() - start
+    scheduler.backoff = backoff
+    server.stop()
+    results['failing server'] = {'searches': count, 'failed': failed, 'requests': server.requests, 'errors': server.errors, 'seconds': seconds}
+    return results
+
+
+def bench_filter(count = 10000, repeat = 5):
+    """Measures filtering a large page: building the index, a single query and
+    the queries made while typing a word."""
+
+    page = SearchPage('search result')
+    page.videos = [Video(make_item(i)) for i in range(count)]
+    start = time.perf_counter()
+    page.filter('number')
+    build = time.perf_counter() - start
+    query = min(timeit.repeat(lambda: page.filter('video 12'), number = 1, repeat = repeat))
+    def type_word():
+        within = None
+        for i in range(1, 8):
+            within = page.filter('reasona'[:i] + ' 12', within)
+    typing = min(timeit.repeat(type_word, number = 1, repeat = repeat))
+    return {'filter': {'index_build_ms': build * 1000, 'query_ms': query * 1000, 'typing_word_ms': typing * 1000}}
+
+
+def bench_columns(sizes = (10000, 100000, 1000000), height = 50, width = 160):
+    """Compares pages keeping their videos in a list and in columns, at
+    several sizes: the memory of the videos, the first filter (building the
+    index or search text) and a later one, sorting by views and drawing the
+    first rows once sorted."""
+
+    settings = Settings()
+    settings.title_style = 0
+    results = {}
+    for size in sizes:
+        for name in ('list', 'columns'):
+            page = SearchPage('search result')
+            tracemalloc.start()
+            videos = (Video(make_item(i)) for i in range(size))
+            page.videos = list(videos) if name == 'list' else VideoColumns(videos)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            page.filter('number 12')
+            first_filter = time.perf_counter() - start
+            filter = min(timeit.repeat(lambda: page.filter('video 12'), number = 1, repeat = 3))
+            page.sort = (('views', True),)
+            start = time.perf_counter()
+            page.view()
+            sort = time.perf_counter() - start
+            format_shown_rows.cache_clear()
+            start = time.perf_counter()
+            page.draw_main_pane(VirtualScreen(height, width), settings)
+            draw = time.perf_counter() - start
+            results['%s %d' % (name, size)] = {'mb': memory / 2 ** 20, 'first_filter_ms': first_filter * 1000,
+                                               'filter_ms': filter * 1000, 'sort_ms': sort * 1000, 'draw_ms': draw * 1000}
+            del page
+    return results
+
+
+def bench_draw(count = 1000, height = 50, width = 160):
+    """Measures drawing pages of videos on a virtual screen, scrolling through
+    new rows and redrawing the same rows."""
+
+    settings = Settings()
+    settings.title_style = 0
+    results = {}
+    for simple in (True, False):
+        settings.simple_video_format = simple
+        page = SearchPage('search result')
+        page.videos = [Video(make_item(i)) for i in range(count)]
+        screen = VirtualScreen(height, width)
+        format_shown_rows.cache_clear()
+        frames = 0
+        start = time.perf_counter()
+        while (page.start < count - 1):
+            page.draw_main_pane(screen, settings)
+            page.start = page.end
+            frames += 1
+        scroll = (time.perf_counter() - start) / frames
+        page.start = 0
+        redraw = min(timeit.repeat(lambda: page.draw_main_pane(screen, settings), number = 10, repeat = 5)) / 10
+        results['simple' if simple else 'detailed'] = {'new_frame_us': scroll * 1e6, 'same_frame_us': redraw * 1e6}
+    return results
+
+
+startup_script = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, %r)
+import ui
+imported = time.perf_counter()
+ui.Ui().load_session(ui.Store('session.db'))
+print(imported - start, time.perf_counter() - imported)
+"""
+
+def bench_startup(sizes = (10, 100, 500), videos_per_page = 100, repeat = 3):
+    """Measures starting the ui in a new interpreter, up to having the session
+    loaded, for sessions with different numbers of search pages."""
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as path:
+            store = Store(os.path.join(path, 'session.db'))
+            pages = [SubscriptionPage('subscriptions'), BookmarkPage('bookmarks')]
+            for i in range(size):
+                page = SearchPage('search result')
+                page.set_local('term %d' % i, [Video(make_item(i * videos_per_page + j)) for j in range(videos_per_page)])
+                pages.append(page)
+            store.save_session(pages, 0, Settings())
+            store.close()
+            runs = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, '-c', startup_script % os.path.dirname(os.path.abspath(__file__))],
+                                        cwd = path, capture_output = True, text = True, check = True).stdout
+                total = time.perf_counter() - start
+                runs.append((total,) + tuple(float(value) for value in output.split()))
+            total, imports, load = min(runs)
+            results['%d pages' % size] = {'total_ms': total * 1000, 'import_ms': imports * 1000, 'load_ms': load * 1000}
+    return results
+
+
+def bench_player(count = 100):
+    """Drives player.py against fakeplayer.py over its ipc socket, checking
+    that loading, queueing and quitting get the replies mpv would give, and
+    measures a command's round trip."""
+
+    def check(condition, message):
+        if (not condition):
+            raise AssertionError('player: ' + message)
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    player = Player(sys.executable, os.path.join(directory, 'fakeplayer.py'))
+    try:
+        start = time.perf_counter()
+        player.play(['https://example.com/1', 'https://example.com/2'])
+        started = time.perf_counter() - start
+        check(player.command('get_property', 'playlist-count') == 2, 'both videos should be loaded')
+        player.play(['https://example.com/3'], append = True)
+        playlist = [entry['filename'] for entry in player.command('get_property', 'playlist')]
+        check(playlist == ['https://example.com/1', 'https://example.com/2', 'https://example.com/3'], 'queued video should be appended')
+        try:
+            player.command('loadfile', 'https://example.com/4', 'sideways')
+            check(False, 'an invalid load should be refused')
+        except RuntimeError:
+            pass
+        start = time.perf_counter()
+        for i in range(count):
+            player.command('get_property', 'playlist-count')
+        round_trip = (time.perf_counter() - start) / count
+        process = player.process
+        socket_dir = player.socket_dir
+        player.stop()
+        check(process.poll() is not None and player.process is None, 'player should have quit')
+        check(not os.path.exists(socket_dir), 'the socket directory should be removed')
+        # a later play starts the player again
+        player.play(['https://example.com/4'])
+        check(player.command('get_property', 'playlist-count') == 1, 'a new player should be started')
+    finally:
+        player.stop()
+    return {'fake mpv': {'start_ms': started * 1000, 'round_trip_us': round_trip * 1e6}}
+
+
+def run_all():
+    return {
+        'video construction': bench_video(),
+        'display width': bench_width(),
+        'search': bench_search(),
+        'subscription refresh': bench_refresh(),
+        'request scheduler': bench_scheduler(),
+        'filter': bench_filter(),
+        'columns': bench_columns(),
+        'draw': bench_draw(),
+        'startup': bench_startup(),
+        'player': bench_player(),
+    }
+
+
+def print_results(name, results):
+    print(name)
+    for case, values in results.items():
+        print('  ' + case + ': ' + ', '.join('%s=%.2f' % (key, value) for key, value in values.items()))
+
+
+if (__name__ == '__main__'):
+    results = run_all()
+    for name, result in results.items():
+        print_results(name, result)
+    if (len(sys.argv) > 1):
+        report = {'time': time.time(), 'python': platform.python_version(), 'results': results}
+        json.dump(report, open(sys.argv[1], 'w'), indent = 1)
@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+import time
+
+class ResponseCache():
+    """An on disk cache of responses keyed by url, with time to live per kind of
+    query and least recently used eviction once it grows over max_size bytes."""
+
+    def __init__(self, path = 'cache', max_size = 32 * 1024 * 1024, ttls = None):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = ttls or {}
+        self.offline = False
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        self.lock = threading.Lock()
+
+
+    def configure(self, max_size, ttls, offline):
+        """Changes the size limit, time to live and offline mode."""
+
+        with self.lock:
+            self.max_size = max_size
+            self.ttls = ttls
+            self.offline = offline
+            if (self.db is not None):
+                self.evict()
+
+
+    def enabled(self):
+        return self.max_size > 0
+
+
+    def open(self):
+        """Opens the database on first use. Must be called with the lock held."""
+
+        if (self.db is None):
+            self.db = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None)
+            self.db.execute('pragma journal_mode = wal')
+            self.db.execute('create table if not exists responses (url text primary key, body blob, '
+                            'etag text, last_modified text, fetched real, accessed real)')
+            self.db.execute('create index if not exists responses_accessed on responses (accessed)')
+        return self.db
+
+
+    def get(self, url):
+        """Returns a tuple of (body, etag, last_modified, fetched) or None."""
+
+        with self.lock:
+            db = self.open()
+            row = db.execute('select body, etag, last_modified, fetched from responses where url = ?', (url,)).fetchone()
+            if (row is not None):
+                db.execute('update responses set accessed = ? where url = ?', (time.time(), url))
+            return row
+
+
+    def is_fresh(self, entry, kind):
+        return time.time() - entry[3] < self.ttls.get(kind, 0)
+
+
+    def put(self, url, body, etag = None, last_modified = None):
+        """Stores a response and evicts old entries if over the size limit."""
+
+        now = time.time()
+        with self.lock:
+            db = self.open()
+            db.execute('insert or replace into responses values (?, ?, ?, ?, ?, ?)', (url, body, etag, last_modified, now, now))
+            self.evict()
+
+
+    def revalidated(self, url):
+        """Marks an entry as fresh after the server answered 304 Not Modified."""
+
+        now = time.time()
+        with self.lock:
+            self.open().execute('update responses set fetched = ?, accessed = ? where url = ?', (now, now, url))
+
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits. Must be
+        called with the lock held."""
+
+        db = self.db
+        size = db.execute('select coalesce(sum(length(body)), 0) from responses').fetchone()[0]
+        if (size <= self.max_size):
+            return
+        cursor = db.execute('select url, length(body) from responses order by accessed')
+        stale = []
+        for url, length in cursor:
+            if (size <= self.max_size):
+                break
+            stale.append((url,))
+            size -= length
+        db.executemany('delete from responses where url = ?', stale)
+
+
+    def format(self):
+        """Returns a short string with the hit and miss counts."""
+
+        return 'cache h:' + str(self.hits) + ' m:' + str(self.misses)
@@ -0,0 +1,299 @@
+"""Keeps the videos of very large pages in columns instead of one Video object
+each. Counts and times are typed arrays, titles, descriptions and ids are
+utf-8 bytes pooled in one buffer per field and uploaders are numbers into a
+list of the distinct names. Video objects are only made for the rows that
+are used, like the ones drawn, and filtering and sorting work on whole
+columns."""
+
+import bisect
+from array import array
+from textindex import tokenize
+from video import Video, intern_video, known_videos
+
+class StringColumn():
+    """Strings stored end to end in one buffer of utf-8 bytes."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array('Q')
+
+
+    def __len__(self):
+        return len(self.ends)
+
+
+    def __getitem__(self, row):
+        start = self.ends[row - 1] if row > 0 else 0
+        return self.data[start:self.ends[row]].decode()
+
+
+    def append(self, string):
+        self.data += string.encode()
+        self.ends.append(len(self.data))
+
+
+    def truncate(self, rows):
+        """Keeps only the first rows strings."""
+
+        del self.data[self.ends[rows - 1] if rows > 0 else 0:]
+        del self.ends[rows:]
+
+
+    def nbytes(self):
+        return len(self.data) + self.ends.itemsize * len(self.ends)
+
+
+class VideoColumns():
+    """A list of videos stored by column. It can be used like the list of
+    videos of a page: indexing and iterating give Video objects, made from
+    the columns unless the video is already in use. Changes other than
+    appending or replacing the last rows rebuild the columns, they are meant
+    for pages that mostly grow."""
+
+    # the typed columns and the field of Video each one holds
+    numbers = (('uploaded', 'q'), ('length', 'q'), ('views', 'q'), ('likes', 'q'),
+               ('dislikes', 'q'), ('comment_count', 'q'), ('rating', 'd'))
+
+    def __init__(self, videos = ()):
+        self.clear()
+        self.extend(videos)
+
+
+    def clear(self):
+        self.ids = StringColumn()
+        self.titles = StringColumn()
+        self.descriptions = StringColumn()
+        self.users = array('L')
+        self.user_names = []
+        self.user_codes = {}
+        self.columns = {name: array(typecode) for name, typecode in VideoColumns.numbers}
+        # counts changes, so that sorted orders and the search text can be kept
+        self.version = 0
+        self.text = None
+        self.text_starts = array('Q')
+        # rows containing the last few terms searched, and the version they are for
+        self.matches = {}
+        self.matches_version = 0
+
+
+    def __len__(self):
+        return len(self.users)
+
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.video(row)
+
+
+    def __getitem__(self, key):
+        if (isinstance(key, slice)):
+            return [self.video(row) for row in range(*key.indices(len(self)))]
+        if (key < 0):
+            key += len(self)
+        if (key < 0 or key >= len(self)):
+            raise IndexError('video index out of range')
+        return self.video(key)
+
+
+    def __setitem__(self, key, videos):
+        if (not isinstance(key, slice)):
+            raise TypeError('videos in columns can only be replaced by slice')
+        start, stop, step = key.indices(len(self))
+        if (stop == len(self) and step == 1):
+            # replacing the end, like the more results of a search replacing
+            # the ones streamed in
+            self.truncate(start)
+            self.extend(videos)
+            return
+        rows = list(self)
+        rows[key] = videos
+        self.clear()
+        self.extend(rows)
+
+
+    def __delitem__(self, key):
+        if (isinstance(key, slice)):
+            start, stop, step = key.indices(len(self))
+            if (stop == len(self) and step == 1):
+                self.truncate(start)
+                return
+        rows = list(self)
+        del rows[key]
+        self.clear()
+        self.extend(rows)
+
+
+    def append(self, video):
+        self.ids.append(video.id)
+        self.titles.append(video.title)
+        self.descriptions.append(video.description)
+        code = self.user_codes.get(video.user)
+        if (code is None):
+            code = self.user_codes[video.user] = len(self.user_names)
+            self.user_names.append(video.user)
+        self.users.append(code)
+        for name, column in self.columns.items():
+            column.append(getattr(video, name))
+        self.version += 1
+
+
+    def extend(self, videos):
+        for video in videos:
+            self.append(video)
+
+
+    def truncate(self, rows):
+        """Keeps only the first rows videos. The names of uploaders that are
+        no longer used stay in the list of names."""
+
+        if (rows >= len(self)):
+            return
+        self.ids.truncate(rows)
+        self.titles.truncate(rows)
+        self.descriptions.truncate(rows)
+        del self.users[rows:]
+        for column in self.columns.values():
+            del column[rows:]
+        if (rows < len(self.text_starts)):
+            self.text = self.text[:self.text_starts[rows]]
+            del self.text_starts[rows:]
+        self.version += 1
+
+
+    def video(self, row):
+        """Returns the video of a row, the one in use if there is one."""
+
+        id = self.ids[row]
+        video = known_videos.get(id)
+        if (video is not None):
+            return video
+        video = Video.__new__(Video)
+        video.id = id
+        video.title = self.titles[row]
+        video.description = self.descriptions[row]
+        video.user = self.user_names[self.users[row]]
+        for name, column in self.columns.items():
+            setattr(video, name, column[row])
+        video.raw = (video.description, video.views, video.rating, video.likes, video.likes + video.dislikes, video.comment_count)
+        return intern_video(video)
+
+
+    def column(self, key):
+        """Returns the values of a sort key of ordering.py for every row."""
+
+        if (key == 'uploader'):
+            names = sorted(range(len(self.user_names)), key = lambda code: self.user_names[code].casefold())
+            ranks = [0] * len(names)
+            for rank, code in enumerate(names):
+                ranks[code] = rank
+            return [ranks[code] for code in self.users]
+        return self.columns[{'duration': 'length', 'date': 'uploaded'}.get(key, key)]
+
+
+    def take(self, rows):
+        return ColumnView(self, array('L', rows))
+
+
+    def search_text(self):
+        """Returns the case folded title, description and uploader of every
+        row as one string, along with the offset each row starts at. Rows
+        appended since the last search are added to it."""
+
+        if (self.text is None):
+            self.text = ''
+            self.text_starts = array('Q')
+        indexed = len(self.text_starts)
+        if (indexed < len(self)):
+            rows = range(indexed, len(self))
+            # folded one by one, folding can change the length of a row
+            parts = [(self.titles[row] + ' ' + self.descriptions[row] + ' ' + self.user_names[self.users[row]] + '\n').casefold() for row in rows]
+            offset = len(self.text)
+            for part in parts:
+                self.text_starts.append(offset)
+                offset += len(part)
+            self.text += ''.join(parts)
+        return (self.text, self.text_starts)
+
+
+    def rows_containing(self, term):
+        """Returns the rows with a word containing a term, in order."""
+
+        if (self.matches_version != self.version or len(self.matches) > 64):
+            self.matches = {}
+            self.matches_version = self.version
+        if (term not in self.matches):
+            self.matches[term] = self.find_rows(term)
+        return self.matches[term]
+
+
+    def find_rows(self, term):
+        text, starts = self.search_text()
+        rows = []
+        find = text.find
+        position = find(term)
+        while (position >= 0):
+            row = bisect.bisect_right(starts, position) - 1
+            rows.append(row)
+            # one match is enough, go on from the next row
+            position = find(term, starts[row + 1]) if row + 1 < len(starts) else -1
+        return rows
+
+
+    def search(self, query, within = None):
+        """Returns the rows matching a query like TextIndex.search does, in
+        order. If within is given only those rows are considered."""
+
+        result = set()
+        for group in query.split('|'):
+            terms = tokenize(group)
+            if (not terms):
+                continue
+            rows = set(within) if within is not None else None
+            for term in sorted(terms, key = len, reverse = True):
+                rows = set(self.rows_containing(term)) if rows is None else rows.intersection(self.rows_containing(term))
+                if (not rows):
+                    break
+            result |= rows
+        return sorted(result)
+
+
+    def nbytes(self):
+        """Returns the bytes used by the columns, without the search text."""
+
+        size = self.ids.nbytes() + self.titles.nbytes() + self.descriptions.nbytes()
+        size += self.users.itemsize * len(self.users) + sum(len(name) for name in self.user_names)
+        return size + sum(column.itemsize * len(column) for column in self.columns.values())
+
+
+class ColumnView():
+    """Some rows of a VideoColumns in an order, like a filtered or sorted
+    page. It cannot be changed."""
+
+    def __init__(self, base, rows):
+        self.base = base
+        self.rows = rows
+        self.version = base.version
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.base.video(row)
+
+
+    def __getitem__(self, key):
+        if (isinstance(key, slice)):
+            return [self.base.video(row) for row in self.rows[key]]
+        return self.base.video(self.rows[key])
+
+
+    def column(self, key):
+        values = self.base.column(key)
+        return [values[row] for row in self.rows]
+
+
+    def take(self, rows):
+        return ColumnView(self.base, array('L', (self.rows[row] for row in rows)))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Refreshes the subscriptions of a session in the background, so that the
+ui starts with their newest uploads instead of fetching them. The users are
+fetched one at a time, spread evenly over the interval, and what is new is
+saved in the session for the ui to merge when it starts or refreshes. Run
+with 'python3 daemon.py' next to the session, or from cron with --once."""
+
+import argparse
+import calendar
+import fcntl
+import os
+import sys
+import time
+from query import *
+from store import Store
+
+def refresh_user(store, user, max_results, timeout):
+    """Fetches the uploads of a user that neither the ui nor an earlier run
+    has seen and saves them. Returns the number saved."""
+
+    known, newest = known_uploads(store, user)
+    videos = search_user_since(user, known, newest, max_results, timeout = timeout)
+    # the ui may have refreshed while fetching
+    with store.locked():
+        known, newest = known_uploads(store, user)
+        videos = [video for video in videos if video.id not in known]
+        store.add_prefetched(user, videos)
+    return len(videos)
+
+
+def known_uploads(store, user):
+    """Returns the ids of the uploads of a user already seen or prefetched and
+    the upload time of the newest of them."""
+
+    known = set()
+    newest = None
+    for state in store.load_states('SubscriptionPage'):
+        known.update(state.get('seen', {}).get(user, ()))
+        newest = state.get('newest', {}).get(user, newest)
+    if (isinstance(newest, time.struct_time)):
+        newest = calendar.timegm(newest)
+    ids, uploaded = store.prefetched_ids(user)
+    known |= ids
+    if (uploaded is not None):
+        newest = max(newest or 0, uploaded)
+    return (known, newest)
+
+
+def subscribed_users(store):
+    users = []
+    for state in store.load_states('SubscriptionPage'):
+        users.extend(user for user in state.get('user_list', []) if user not in users)
+    return users
+
+
+def run(store, interval, max_results, timeout, once, log):
+    while True:
+        start = time.monotonic()
+        users = subscribed_users(store)
+        for i, user in enumerate(users):
+            # spread the fetches over the interval instead of bursting
+            delay = start + i * interval / len(users) - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+            try:
+                count = refresh_user(store, user, max_results, timeout)
+                log('%s: %d new' % (user, count))
+            except Exception as e:
+                log('%s: %s' % (user, e))
+        if (once):
+            return
+        time.sleep(max(start + interval - time.monotonic(), 1))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--session', default = 'session.db', help = 'session to refresh (default session.db)')
+    parser.add_argument('-i', '--interval', type = float, default = 900, help = 'seconds between refreshes of a user (default 900)')
+    parser.add_argument('-n', '--max-results', type = int, default = 20, help = 'most uploads fetched per user (default 20)')
+    parser.add_argument('-t', '--timeout', type = float, default = 10, help = 'seconds to wait on the network per request (default 10)')
+    parser.add_argument('--once', action = 'store_true', help = 'refresh every user once and exit')
+    parser.add_argument('-q', '--quiet', action = 'store_true', help = 'do not log every fetch')
+    parser.add_argument('--api-base', help = 'server to send searches to')
+    args = parser.parse_args(argv)
+    if (not os.path.isfile(args.session)):
+        parser.error('no session at ' + args.session)
+    if (args.api_base):
+        set_api_base(args.api_base)
+    # always ask the server, responses are still revalidated from the cache
+    cache.configure(cache.max_size, {}, False)
+    log = (lambda message: None) if args.quiet else (lambda message: print(time.strftime('%H:%M:%S ') + message, flush = True))
+    store = Store(args.session)
+    lock = open(args.session + '.daemon', 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print('another daemon is refreshing ' + args.session, file = sys.stderr)
+        return 1
+    run(store, args.interval, args.max_results, args.timeout, args.once, log)
+    return 0
+
+
+if (__name__ == '__main__'):
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""A stand in for mpv that answers the json ipc commands the Player sends,
+without playing anything. Use it by setting player to 'python3' and
+player_args to 'fakeplayer.py'. It keeps a playlist that can be read with
+the playlist and playlist-count properties, and sends an event for every
+file loaded like mpv does."""
+
+import json
+import os
+import socket
+import sys
+
+def handle(command, playlist):
+    """Runs a command, returning the data of the reply or raising ValueError."""
+
+    name = command[0]
+    if (name == 'loadfile'):
+        mode = command[2] if len(command) > 2 else 'replace'
+        if (mode == 'replace'):
+            playlist[:] = [command[1]]
+        elif (mode in ('append', 'append-play')):
+            playlist.append(command[1])
+        else:
+            raise ValueError('invalid parameter')
+        return None
+    if (name == 'get_property'):
+        if (command[1] == 'playlist'):
+            return [{'filename': url} for url in playlist]
+        if (command[1] == 'playlist-count'):
+            return len(playlist)
+        raise ValueError('property not found')
+    raise ValueError('invalid parameter')
+
+
+def serve(path):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    playlist = []
+    try:
+        while True:
+            conn, address = server.accept()
+            with conn, conn.makefile('rb') as lines:
+                for line in lines:
+                    message = json.loads(line)
+                    command = message['command']
+                    if (command[0] == 'quit'):
+                        conn.sendall(json.dumps({'error': 'success', 'request_id': message.get('request_id')}).encode() + b'\n')
+                        return
+                    reply = {'request_id': message.get('request_id'), 'error': 'success'}
+                    try:
+                        reply['data'] = handle(command, playlist)
+                    except (ValueError, IndexError) as e:
+                        reply['error'] = str(e)
+                    if (command[0] == 'loadfile' and reply['error'] == 'success'):
+                        conn.sendall(b'{"event":"start-file"}\n')
+                    conn.sendall(json.dumps(reply).encode() + b'\n')
+    finally:
+        server.close()
+        os.remove(path)
+
+
+if (__name__ == '__main__'):
+    options = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+    serve(options['input-ipc-server'])
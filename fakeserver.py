@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""A local stand in for the gdata api, serving generated jsonc feeds with
+configurable latency, size and error rate. Run with
+'python3 fakeserver.py [port]' and set api_base to the printed url."""
+
+import gzip
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+def make_item(i, user = None, description_length = 8):
+    """Returns a jsonc item like the ones the api sends."""
+
+    return {
+        'id': 'video%07d' % i,
+        'uploaded': '2013-%02d-%02dT%02d:%02d:%02d.000Z' % (i % 12 + 1, i % 28 + 1, i % 24, i % 60, i % 60),
+        'updated': '2013-06-01T00:00:00.000Z',
+        'uploader': user if user is not None else 'user%d' % (i % 150),
+        'category': 'Music',
+        'title': 'video number %d with a reasonably long title' % i,
+        'description': 'description of video %d, ' % i * description_length,
+        'duration': 60 + i % 3600,
+        'rating': 4.5 + (i % 50) / 100,
+        'likeCount': str(i * 7 % 10000),
+        'ratingCount': i * 9 % 12000 + 10000,
+        'viewCount': i * 131 % 10000000,
+        'commentCount': i % 1000,
+    }
+
+
+def stable_hash(string):
+    return zlib.crc32(string.encode('utf8'))
+
+
+def make_upload(user, i):
+    """Returns the i-th newest upload of a user, one upload per hour."""
+
+    item = make_item(stable_hash(user) % 100000 * 1000 + i, user)
+    uploaded = time.gmtime(1400000000 - stable_hash(user) % 3600 - i * 3600)
+    item['uploaded'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', uploaded)
+    return item
+
+
+class FakeServer():
+    """A threaded http server answering feed requests. latency is added to
+    every response, feed_size is the number of results every feed has,
+    description_length scales the size of items and error_rate is the
+    fraction of requests answered with a 503."""
+
+    def __init__(self, port = 0, latency = 0, feed_size = 500, description_length = 8, error_rate = 0, seed = 0):
+        self.latency = latency
+        self.feed_size = feed_size
+        self.description_length = description_length
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are sent separately, nagle would hold the body back
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                with server.lock:
+                    server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d/feeds/api' % self.httpd.server_address[1]
+
+
+    def start(self):
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+    def feed(self, path, params):
+        """Returns the items of the feed at a path or None if there is none."""
+
+        start = int(params.get('start-index', 1)) - 1
+        count = int(params.get('max-results', 25))
+        indexes = range(start, min(start + count, self.feed_size))
+        parts = path.strip('/').split('/')
+        if (parts[-1] == 'videos'):
+            term = params.get('q', '')
+            return [make_item(stable_hash(term) % 1000 * 10000 + i, description_length = self.description_length) for i in indexes]
+        if (len(parts) >= 2 and parts[-1] == 'uploads'):
+            return [make_upload(urllib.parse.unquote(parts[-2]), i) for i in indexes]
+        return None
+
+
+    def handle(self, request):
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            if (failed):
+                self.errors += 1
+        if (self.latency):
+            time.sleep(self.latency)
+        url = urllib.parse.urlsplit(request.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        items = self.feed(url.path, params)
+        if (failed or items is None):
+            status = 503 if failed else 404
+            body = json.dumps({'error': {'code': status}}).encode()
+        else:
+            status = 200
+            body = json.dumps({'apiVersion': '2.1', 'data': {'totalItems': self.feed_size, 'items': items}}).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if ('gzip' in request.headers.get('Accept-Encoding', '')):
+            body = gzip.compress(body, 1)
+            request.send_header('Content-Encoding', 'gzip')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+if (__name__ == '__main__'):
+    server = FakeServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print('serving on ' + server.url)
+    server.httpd.serve_forever()
@@ -1,39 +1,100 @@
+import functools
 import time
 import string
-from unicodedata import east_asian_width
+import unicodedata
 
 
+# ascii letters and digits, a word is not split across lines at these
+word_chars = frozenset(string.ascii_letters + string.digits)
+
+# display width of every character of the basic multilingual plane and a
+# str.translate table that maps every one of them to as many characters as the
+# columns it takes, both built on first use. The table is a list indexed by
+# code point, which str.translate looks up much faster than a dict
+bmp_widths = None
+width_table = None
+
+
+@functools.lru_cache(maxsize = 1024)
+def compute_char_width(char):
+    """Computes the number of columns a character takes up."""
+
+    if (char == '\u00ad'):
+        return 1
+    if (unicodedata.combining(char) or unicodedata.category(char) in ('Mn', 'Me', 'Cf')):
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
+
+def get_bmp_widths():
+    global bmp_widths, width_table
+    if (bmp_widths is None):
+        bmp_widths = bytes(compute_char_width.__wrapped__(chr(code)) for code in range(0x10000))
+        width_table = [('', ' ', '  ')[width] for width in bmp_widths]
+    return bmp_widths
+
+
+def char_width(char):
+    """Gets the number of columns a character takes up: 0 for combining and zero
+    width characters, 2 for double width characters and 1 for the rest."""
+
+    code = ord(char)
+    if (code >= 0x10000):
+        return compute_char_width(char)
+    return get_bmp_widths()[code]
+
+
+@functools.lru_cache(maxsize = 4096)
 def get_real_width(str):
     """Gets real width of a string accounting for double width characters."""
 
-    real_width = 0
-    for char in str:
-        real_width += 2 if east_asian_width(char) == 'W' else 1
-    return real_width
+    if (str.isascii()):
+        return len(str)
+    get_bmp_widths()
+    # characters outside the table are left as they are
+    spaces = str.translate(width_table)
+    if (spaces.isascii()):
+        return len(spaces)
+    return sum(1 if char == ' ' else compute_char_width(char) for char in spaces)
 
 
+@functools.lru_cache(maxsize = 4096)
 def fit_string_split(str, width):
     """Fits a string into a width, truncates if it is over and pads if it is under.
     Returns a tuple with the first entry being the fitted part and the second
     the rest of the string.
     """
 
-    real_width = 0
-    index = 0
-    while (index < len(str)):
-        double_width = east_asian_width(str[index]) == 'W'
-        real_width += 2 if double_width else 1
-        if (real_width > width):
-            padding = 0
-            while (str[index] in string.ascii_letters + string.digits  and east_asian_width(str[index]) != 'W'):
-                index -= 1
-                padding += 1 
-            if (double_width and real_width - width == 1):
-                return (str[0:index] + ' ' * (padding + 1), str[index + 1:])
-            else:
-                return (str[0:index] + ' ' * (padding) , str[index + 1:])
-        index += 1
-    return (str + ' ' * (width - real_width), '')
+    if (str.isascii()):
+        if (len(str) <= width):
+            return (str + ' ' * (width - len(str)), '')
+        index = width
+        fitted_width = width
+    else:
+        widths = get_bmp_widths()
+        real_width = 0
+        index = 0
+        for char in str:
+            code = ord(char)
+            char_columns = widths[code] if code < 0x10000 else compute_char_width(char)
+            real_width += char_columns
+            if (real_width > width):
+                break
+            index += 1
+        else:
+            return (str + ' ' * (width - real_width), '')
+        fitted_width = real_width - char_columns
+    overflow = index
+    fitted = fitted_width
+    # go back to the start of the word that overflows, zero width characters
+    # like combining marks belong to the word before them
+    while (str[index] in word_chars or char_width(str[index]) == 0):
+        index -= 1
+        if (index < 0):
+            # a single word longer than the width, break it where it overflows
+            return (str[0:overflow] + ' ' * (width - fitted), str[overflow:])
+        fitted_width -= char_width(str[index])
+    return (str[0:index] + ' ' * (width - fitted_width), str[index + 1:])
 
 
 def fit_string(str, width):
@@ -0,0 +1,74 @@
+import queue
+import threading
+
+class Job():
+    """A piece of work run on a worker thread. The work is called with the job,
+    so that it can check whether it was cancelled and report partial results.
+    done is called with its result, update with each partial result and
+    failed with the error if the work raised one, on the thread that collects
+    them."""
+
+    def __init__(self, work, done, update, finished, failed = None):
+        self.work = work
+        self.done = done
+        self.update = update
+        self.failed = failed
+        self.finished = finished
+        self.cancelled = threading.Event()
+        self.result = None
+        self.error = None
+
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+    def report(self, value):
+        """Sends a partial result, called from the worker thread."""
+
+        self.finished.put((self, value))
+
+
+class Workers():
+    """A pool of daemon threads running jobs, so that quitting never waits on
+    the network."""
+
+    def __init__(self, count = 4):
+        self.tasks = queue.Queue()
+        self.finished = queue.Queue()
+        for i in range(count):
+            threading.Thread(target = self.run, daemon = True).start()
+
+
+    def submit(self, work, done, update = None, failed = None):
+        """Queues work and returns its Job."""
+
+        job = Job(work, done, update, self.finished, failed)
+        self.tasks.put(job)
+        return job
+
+
+    def run(self):
+        while True:
+            job = self.tasks.get()
+            if (job.cancelled.is_set()):
+                continue
+            try:
+                job.result = job.work(job)
+            except Exception as e:
+                job.error = e
+            self.finished.put((job, None))
+
+
+    def collect(self):
+        """Returns (job, value) tuples for the partial results and finished jobs
+        since the last call, without waiting. value is None when the job finished."""
+
+        events = []
+        while True:
+            try:
+                job, value = self.finished.get_nowait()
+            except queue.Empty:
+                return events
+            if (not job.cancelled.is_set()):
+                events.append((job, value))
@@ -0,0 +1,64 @@
+import json
+import sqlite3
+import threading
+import time
+from textindex import tokenize
+from video import make_video
+
+class Library():
+    """A local full text index of every video that was fetched, so that they can
+    be found again without a request."""
+
+    def __init__(self, path = 'library.db'):
+        self.path = path
+        self.enabled = True
+        self.db = None
+        self.lock = threading.Lock()
+
+
+    def open(self):
+        """Opens the database on first use. Must be called with the lock held."""
+
+        if (self.db is None):
+            self.db = sqlite3.connect(self.path, check_same_thread = False)
+            self.db.execute('pragma journal_mode = wal')
+            with self.db:
+                self.db.execute('create table if not exists videos (rowid integer primary key, id text unique, data text, seen real)')
+                self.db.execute('create virtual table if not exists videos_text using fts5(title, description, uploader)')
+        return self.db
+
+
+    def record(self, videos):
+        """Adds videos to the library, updating the ones already in it."""
+
+        if (not self.enabled or not videos):
+            return
+        now = time.time()
+        with self.lock:
+            db = self.open()
+            with db:
+                for video in videos:
+                    row = db.execute('select rowid from videos where id = ?', (video.id,)).fetchone()
+                    data = json.dumps(video.to_data())
+                    if (row is None):
+                        rowid = db.execute('insert into videos (id, data, seen) values (?, ?, ?)', (video.id, data, now)).lastrowid
+                    else:
+                        rowid = row[0]
+                        db.execute('update videos set data = ?, seen = ? where rowid = ?', (data, now, rowid))
+                        db.execute('delete from videos_text where rowid = ?', (rowid,))
+                    db.execute('insert into videos_text (rowid, title, description, uploader) values (?, ?, ?, ?)',
+                               (rowid, video.title, video.description, video.user))
+
+
+    def search(self, query, limit = 200):
+        """Returns the videos matching every word of a query, best matches first.
+        Words match as prefixes and titles and uploaders weigh more than descriptions."""
+
+        words = tokenize(query)
+        if (not words):
+            return []
+        match = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+        with self.lock:
+            rows = self.open().execute('select videos.data from videos_text join videos on videos.rowid = videos_text.rowid '
+                                       'where videos_text match ? order by bm25(videos_text, 10.0, 1.0, 5.0) limit ?', (match, limit)).fetchall()
+        return [make_video(json.loads(data), update = False) for data, in rows]
@@ -0,0 +1,65 @@
+"""Orders the videos of a page by their fields, without searching again.
+An ordering is a tuple of (key, descending) tuples, the first key deciding
+and the next ones breaking ties."""
+
+sort_keys = {
+    'views': lambda video: video.views,
+    'rating': lambda video: video.rating,
+    'likes': lambda video: video.likes,
+    'duration': lambda video: video.length,
+    'date': lambda video: video.uploaded,
+    'uploader': lambda video: video.user.casefold(),
+}
+
+# the orderings the o key cycles through, None being the order of the page
+orderings = [
+    None,
+    (('views', True),),
+    (('rating', True), ('likes', True)),
+    (('likes', True),),
+    (('duration', True),),
+    (('date', True),),
+    (('uploader', False), ('date', True)),
+]
+
+def parse_ordering(text):
+    """Parses an ordering written like 'uploader,-date', a - sorting by a key
+    in descending order. Returns None for an empty one and raises ValueError
+    for unknown keys."""
+
+    ordering = []
+    for word in text.replace(' ', ',').split(','):
+        if (not word):
+            continue
+        descending = word.startswith('-')
+        key = word.lstrip('-+')
+        if (key not in sort_keys):
+            raise ValueError('cannot sort by ' + key + ', only by ' + ', '.join(sort_keys))
+        ordering.append((key, descending))
+    return tuple(ordering) or None
+
+
+def format_ordering(ordering):
+    return ','.join(('-' if descending else '') + key for key, descending in ordering)
+
+
+def next_ordering(ordering):
+    """Returns the ordering after one in the cycle of the o key."""
+
+    index = orderings.index(ordering) if ordering in orderings else 0
+    return orderings[(index + 1) % len(orderings)]
+
+
+def permutation(videos, ordering):
+    """Returns the indexes of videos in the order given by an ordering. The
+    sort is stable, videos that compare equal keep their order."""
+
+    indexes = list(range(len(videos)))
+    # pages kept in columns give the values of a key without making videos
+    column = getattr(videos, 'column', None)
+    # sorting by the last key first leaves ties ordered by it
+    for key, descending in reversed(ordering):
+        get = sort_keys[key]
+        values = column(key) if column is not None else [get(video) for video in videos]
+        indexes.sort(key = values.__getitem__, reverse = descending)
+    return indexes
@@ -1,9 +1,18 @@
-import curses
+import bisect
+import calendar
+import functools
+import heapq
+import sys
 from query import *
+from columns import ColumnView, VideoColumns
+from ordering import permutation
+from textindex import TextIndex, tokenize
 
 class Page():
     """A class respenting a page in the UI."""
 
+    # attributes that are rebuilt rather than saved
+    transient = ('index', 'positions', 'indexed', 'hydrated', 'sorted', 'size', 'viewed', 'dirty', 'version')
 
     def __init__(self, type):
         """Creates a new Page object with default values."""
@@ -11,6 +20,14 @@ class Page():
         self.type = type
         self.videos = []
         self.start = 0
+        self.end = 0
+
+
+    def changed(self):
+        """Counts a change to the videos of the page, to be called whenever they
+        are replaced or changed in place."""
+
+        self.version = getattr(self, 'version', 0) + 1
 
 
     def format(self):
@@ -18,6 +35,8 @@ class Page():
 
         if (self.type == 'bookmarks' or self.type == 'subscriptions'):
             return self.type
+        elif (getattr(self, 'local', False)):
+            return 'l:' + self.term
         elif (not hasattr(self, 'user')):
             if (hasattr(self, 'term')):
                 return 'f:' + self.term
@@ -29,97 +48,346 @@ class Page():
             return 'u:' + self.user + '/' + self.term
 
 
-    def draw_main_pane(self, win, ui):
+    def filter(self, query, within = None):
+        """Returns the videos of the page matching a query, in page order.
+        within can be an earlier result for a query the new one narrows, then
+        only its videos are considered."""
+
+        if (isinstance(self.videos, (VideoColumns, ColumnView))):
+            return self.filter_columns(query, within)
+        if (not tokenize(query)):
+            return list(within if within is not None else self.videos)
+        videos = self.videos
+        # the index and the row of every id are brought up to date only when
+        # the videos changed since
+        indexed = (id(videos), getattr(self, 'version', 0), Video.updates)
+        if (getattr(self, 'indexed', None) != indexed):
+            if (not hasattr(self, 'index')):
+                self.index = TextIndex()
+            self.index.sync(videos)
+            self.positions = {video.id: row for row, video in enumerate(videos)}
+            self.indexed = indexed
+        ids = self.index.search(query, {video.id for video in within} if within is not None else None)
+        return [videos[row] for row in sorted(self.positions[id] for id in ids)]
+
+
+    def filter_columns(self, query, within):
+        """filter for pages kept in columns, searching the columns instead of
+        an index."""
+
+        videos = self.videos
+        columns = getattr(videos, 'base', videos)
+        rows = getattr(videos, 'rows', None)
+        if (isinstance(within, ColumnView) and within.base is columns):
+            rows = within.rows
+        if (not tokenize(query)):
+            return columns.take(rows if rows is not None else range(len(columns)))
+        return columns.take(columns.search(query, rows))
+
+
+    def pack(self, threshold):
+        """Moves the videos of the page into columns if it has at least
+        threshold of them, 0 never does."""
+
+        if (threshold > 0 and isinstance(self.videos, list) and len(self.videos) >= threshold):
+            self.videos = VideoColumns(self.videos)
+            self.changed()
+
+
+    def resident_size(self):
+        """Returns an estimate of the bytes the videos of the page take in
+        memory. Videos on several pages are counted on each, and a filtered
+        page counts the columns of the page it was filtered from."""
+
+        videos = self.videos
+        key = (id(videos), len(videos), getattr(videos, 'version', None))
+        if (getattr(self, 'size', None) is None or self.size[0] != key):
+            if (isinstance(videos, VideoColumns)):
+                size = videos.nbytes()
+            elif (isinstance(videos, ColumnView)):
+                size = videos.rows.itemsize * len(videos.rows) + videos.base.nbytes()
+            else:
+                size = sys.getsizeof(videos) + sum(video.size() for video in videos)
+            self.size = (key, size)
+        return self.size[1]
+
+
+    def view(self):
+        """Returns the videos in the order they are shown, sorted by the
+        page's sort ordering if it has one. Sorted orders are kept until the
+        videos of the page or their counts change."""
+
+        sort = getattr(self, 'sort', None)
+        videos = self.videos
+        if (sort is None):
+            return videos
+        # the page counts changes to its list, the columns count their own
+        fingerprint = (id(videos), getattr(self, 'version', 0), getattr(videos, 'version', Video.updates))
+        if (getattr(self, 'sorted', None) is None or self.sorted[0] != fingerprint):
+            self.sorted = (fingerprint, {})
+        views = self.sorted[1]
+        if (sort not in views):
+            if (isinstance(videos, list)):
+                views[sort] = [videos[i] for i in permutation(videos, sort)]
+            else:
+                # only the rows drawn are made into videos
+                views[sort] = videos.take(permutation(videos, sort))
+        return views[sort]
+
+
+    def fit(self, videos_per_page):
+        """Sets start and end to the videos shown from start, moving start
+        back if the page ends before the window does."""
+
+        end = min(len(self.videos), self.start + videos_per_page)
+        self.start = max(min(self.start, end - videos_per_page), 0)
+        self.end = end
+
+
+    def draw_main_pane(self, screen, ui):
         """Redraws the main pane."""
 
-        h, w = win.getmaxyx()
-        h -= 2
-        info_pane_start = w - ui.info_width if not ui.simple_video_format else w
-        info_pane = curses.newwin(h, ui.info_width, 0, info_pane_start)
-        item_height = 2 if ui.simple_video_format else 3
-        main_pane = curses.newwin(h + item_height - 1, info_pane_start, 0, 0)
-        videos_per_page = h // item_height
+        h, w = screen.windows['main'].getmaxyx()
+        self.fit(h // (2 if ui.simple_video_format else 3))
         start = self.start
-        end = min(len(self.videos), start + videos_per_page)
-        start = max(min(start, end - videos_per_page), 0)
-        self.start = start
-        self.end = end
+        end = self.end
+        styles = {'title': ui.title_style, None: 0}
         y = 0
-        for video in self.videos[start:end]:
-            if (ui.show_real_index):
-                title, desc = video.format_title_desc(y // item_height + start + 1)
-            else:
-                title, desc = video.format_title_desc(y // item_height)
-            if (ui.simple_video_format):
-                main_pane.addstr(y, 0, title, ui.title_style)
-                user = video.user
-                main_pane.addstr(y, w - len(user), user, ui.title_style)
-                info = [ 'views:' + format_int(video.views, 4)\
-                       , 'duration:' + quick_fit_string(format_time(video.length), 8)\
-                       , 'rating:' + quick_fit_string(str(video.rating), 4)\
-                       , 'likes:' + format_int(video.likes, 4)\
-                       , 'dislikes:' + format_int(video.dislikes, 4)\
-                       , 'date:' + time.strftime('%d/%m/%y', video.uploaded)]
-                main_pane.addstr(y + 1, 0, center(info, w))
-                y += 2
-            else:
-                user, info1, info2 = video.format_info()
-                main_pane.addstr(y, 0, title, ui.title_style)
-                info_pane.addstr(y, 0, user, ui.title_style)
-                y += 1
-                main_pane.addstr(y, 0, desc)
-                info_pane.addstr(y, 0, info1)
-                y += 1
-                info_pane.addstr(y, 0, info2)
+        for i, video in enumerate(self.view()[start:end]):
+            number = i + start + 1 if ui.show_real_index else i
+            for row in format_video_rows(video, number, w, ui.info_width, ui.simple_video_format):
+                screen.put('main', y, [(x, text, styles[style]) for x, text, style in row])
                 y += 1
-        main_pane.refresh()
-        info_pane.refresh()
+        screen.clear_rows('main', y)
+
+
+def format_video_rows(video, number, width, info_width, simple):
+    """Formats the rows of a video on a page of a width. Returns a list of rows,
+    each a list of (x, text, style) segments."""
+
+    # cached by the values shown rather than the video, so that the cache does
+    # not keep videos alive and videos updated in place are formatted again
+    shown = (video.id, video.title, video.user, video.uploaded, video.length, video.raw)
+    return format_shown_rows(shown, number, width, info_width, simple)
+
+
+@functools.lru_cache(maxsize = 1024)
+def format_shown_rows(shown, number, width, info_width, simple):
+    video = Video.__new__(Video)
+    video.id, video.title, video.user, video.uploaded, video.length, video.raw = shown
+    title, desc = video.format_title_desc(number)
+    if (simple):
+        user = video.user
+        info = [ 'views:' + format_int(video.views, 4)\
+               , 'duration:' + quick_fit_string(format_time(video.length), 8)\
+               , 'rating:' + quick_fit_string(str(video.rating), 4)\
+               , 'likes:' + format_int(video.likes, 4)\
+               , 'dislikes:' + format_int(video.dislikes, 4)\
+               , 'date:' + time.strftime('%d/%m/%y', time.gmtime(video.uploaded))]
+        title_width = max(width - get_real_width(user) - 1, 0)
+        return [[(0, fit_string(title, title_width), 'title'), (width - get_real_width(user), user, 'title')],
+                [(0, center(info, width), None)]]
+    else:
+        user, info1, info2 = video.format_info()
+        info_start = width - info_width
+        return [[(0, fit_string(title, info_start), 'title'), (info_start, user, 'title')],
+                [(0, fit_string(desc.replace('\n', ' '), info_start), None), (info_start, info1, None)],
+                [(info_start, info2, None)]]
 
 
 class BookmarkPage(Page):
-    """Class representing a page of bookmarks."""
-    
+    """Class representing a page of bookmarks. Every bookmark has a rank, the
+    seq it is saved with, and the ranks increase down the page so a bookmark
+    is found by bisecting them. Moves and deletes return the bookmarks whose
+    rank changed so that only their rows are saved."""
+
+    transient = Page.transient + ('ranks', 'order')
+
+    def pack(self, threshold):
+        # bookmarks are moved one by one, which columns are not made for
+        pass
+
+
+    def set_ranks(self, ranks):
+        """Sets the ranks of the videos in order, dropping videos that were
+        bookmarked twice."""
+
+        self.ranks = {}
+        self.order = []
+        videos = []
+        for video, rank in zip(self.videos, ranks):
+            if (video.id not in self.ranks):
+                self.ranks[video.id] = rank
+                self.order.append(rank)
+                videos.append(video)
+        self.videos = videos
+        self.changed()
+
+
+    def check_ranks(self):
+        # pages from older sessions and new pages are saved in list order
+        if (getattr(self, 'ranks', None) is None or len(self.order) != len(self.videos)):
+            self.set_ranks(range(len(self.videos)))
+
+
+    def position(self, video):
+        """Returns the index of a bookmark."""
+
+        self.check_ranks()
+        return bisect.bisect_left(self.order, self.ranks[video.id])
+
+
+    def contains(self, video):
+        self.check_ranks()
+        return video.id in self.ranks
+
+
     def swap(self, video, shift):
-        """Swaps 2 items in a list."""
-    
-        index = self.videos.index(video)
-        if ((index == 0 and shift < 0) or (index == len(self.videos) - 1 and shift > 0)):
-            return
-        else:
-            self.videos[index + shift], self.videos[index] = self.videos[index], self.videos[index + shift]
-     
+        """Swaps a bookmark with the one shift places away. Returns the
+        (video, rank) pairs that changed."""
+
+        index = self.position(video)
+        other = index + shift
+        if (other < 0 or other >= len(self.videos)):
+            return []
+        videos = self.videos
+        videos[index], videos[other] = videos[other], videos[index]
+        self.changed()
+        # the ranks stay in place, the videos trade them
+        self.ranks[videos[index].id] = self.order[index]
+        self.ranks[videos[other].id] = self.order[other]
+        return [(videos[index], self.order[index]), (videos[other], self.order[other])]
+
+
     def delete(self, video):
-        """Deletes an item in a list."""
+        """Deletes a bookmark."""
+
+        index = self.position(video)
+        return self.delete_range(index, index + 1)
+
+
+    def delete_range(self, start, end):
+        """Deletes the bookmarks from start to end and returns them."""
+
+        self.check_ranks()
+        deleted = self.videos[start:end]
+        del self.videos[start:end]
+        del self.order[start:end]
+        self.changed()
+        for video in deleted:
+            del self.ranks[video.id]
+        return deleted
+
+
+    def move_range(self, start, end, to):
+        """Moves the bookmarks from start to end so that the first of them is
+        at index to once they were taken out. Returns the (video, rank) pairs
+        that changed."""
+
+        self.check_ranks()
+        moved = self.videos[start:end]
+        if (not moved):
+            return []
+        del self.videos[start:end]
+        del self.order[start:end]
+        to = max(0, min(to, len(self.videos)))
+        low = self.order[to - 1] if to > 0 else None
+        high = self.order[to] if to < len(self.order) else None
+        if (low is None and high is None):
+            ranks = list(range(len(moved)))
+        elif (high is None):
+            ranks = [low + i + 1 for i in range(len(moved))]
+        elif (low is None):
+            ranks = [high - len(moved) + i for i in range(len(moved))]
+        else:
+            step = (high - low) / (len(moved) + 1)
+            ranks = [low + step * (i + 1) for i in range(len(moved))]
+        self.videos[to:to] = moved
+        self.changed()
+        if (len(set(ranks)) < len(ranks) or (high is not None and ranks[-1] >= high) or (low is not None and ranks[0] <= low)):
+            # the gap between the ranks ran out of floats, number them again
+            self.set_ranks(range(len(self.videos)))
+            return list(zip(self.videos, self.order))
+        self.order[to:to] = ranks
+        for video, rank in zip(moved, ranks):
+            self.ranks[video.id] = rank
+        return list(zip(moved, ranks))
 
-        index = self.videos.index(video)
-        self.videos = self.videos[:index] + self.videos[index + 1:]
-    
 
     def add_bookmark(self, video):
-        """Adds a bookmark to a bookmark page."""
+        """Adds a bookmark to a bookmark page. Returns its rank, or None if
+        the video already was bookmarked."""
 
+        self.check_ranks()
+        if (video.id in self.ranks):
+            return None
+        rank = self.order[-1] + 1 if self.order else 0
         self.videos.append(video)
+        self.changed()
+        self.order.append(rank)
+        self.ranks[video.id] = rank
+        return rank
 
 
 class SearchPage(Page):
     """Class representing a page of search results."""
 
-    def add_search(self, user, term, ordering, max_results):
-        """Performs a search on a search page."""
+    def set_search(self, user, term, ordering, max_results):
+        """Sets up a search on a search page without fetching anything."""
 
         self.user = user
         self.term = term
         self.ordering = ordering
         self.max_results = max_results
+        self.local = False
+        self.videos = []
+        self.changed()
         if (user != ''):
-            self.videos = search_user(user, term, ordering, max_results)
+            self.stream = user_stream(user, term, ordering, max_results)
         else:
-            self.videos = search_term(term, ordering, max_results)
+            self.stream = term_stream(term, ordering, max_results)
+
+
+    def set_local(self, term, videos):
+        """Shows the results of a search of the local library."""
+
+        self.user = ''
+        self.term = term
+        self.ordering = 'local relevance'
+        self.local = True
+        self.videos = videos
+        self.changed()
+        if (hasattr(self, 'stream')):
+            # the page may have shown a search before, there is nothing more to fetch
+            del self.stream
+
+
+    def add_search(self, user, term, ordering, max_results):
+        """Performs a search on a search page."""
+
+        self.set_search(user, term, ordering, max_results)
+        self.videos = self.stream.fetch_next()
+        self.changed()
+
+
+    def wants_more(self):
+        """Returns whether the page is scrolled near the end of its results and
+        there are more to fetch."""
+
+        if (not hasattr(self, 'stream') or self.stream.exhausted):
+            return False
+        return len(self.videos) - self.end < 2 * (self.end - self.start)
 
 
 class SubscriptionPage(Page):
     """Class representing a list of subscriptiosn."""
 
+    def pack(self, threshold):
+        # merges splice new uploads in all through the page, which columns
+        # would be rebuilt for every time
+        pass
+
+
     def add_user(self, user):
         """Adds a user to a subscription page."""
 
@@ -129,15 +397,80 @@ class SubscriptionPage(Page):
         self.user_list.append(user)
 
     
-    def refresh_subs(self, max_results):
-        """Refreshes the subscription list."""
+    def refresh_subs(self, max_results, workers = 8, timeout = None):
+        """Fetches uploads newer than the last refresh and merges them into
+        the subscription list. Returns a list of users that could not be fetched.
+        """
+
+        feeds, failed = self.fetch_subs(max_results, workers, timeout)
+        self.merge_subs(feeds, max_results)
+        return failed
+
+
+    def fetch_subs(self, max_results, workers = 8, timeout = None, snapshot = None):
+        """Fetches the uploads of every user newer than the last refresh without
+        changing the page. Returns a tuple of the new uploads by user and a list
+        of users that could not be fetched. When fetching on a worker thread,
+        snapshot must be taken on the main thread so the page is not read
+        while it changes.
+        """
 
         assert self.type == 'subscriptions', 'cannot refresh a non-suscription page'
-        if (hasattr(self, 'user_list')):
+        users, seen, newest = snapshot if snapshot is not None else self.snapshot()
+        fetch = lambda user, timeout, deadline: search_user_since(user, seen.get(user, set()), newest.get(user), max_results, timeout = timeout, deadline = deadline)
+        with timings.measure('refresh', users = len(users)):
+            return fetch_users(users, fetch, workers, timeout)
+
+
+    def snapshot(self):
+        """Returns a copy of what fetch_subs needs of the page: the users and
+        the history of each."""
+
+        seen, newest = self.history()
+        return (list(getattr(self, 'user_list', [])), seen, newest)
+
+
+    def history(self):
+        """Returns a tuple with the first entry being a dict of the set of
+        ids seen by user and the second the upload time of the newest video
+        seen by user. It does not change the page."""
+
+        seen = {user: set(ids) for user, ids in getattr(self, 'seen', {}).items()}
+        # upload times used to be saved as struct_time
+        newest = {user: calendar.timegm(t) if isinstance(t, time.struct_time) else t for user, t in getattr(self, 'newest', {}).items()}
+        return (seen, newest)
+
+
+    def merge_subs(self, feeds, history):
+        """Merges new uploads by user into the sorted subscription list, keeping
+        at most history videos per user. Uploads already merged, like ones
+        fetched both by the ui and in the background, are skipped. Returns a
+        tuple of the videos added and the ids of the videos removed."""
+
+        removed = []
+        if (not hasattr(self, 'seen')):
+            # pages from older sessions have no history, start over
+            self.seen = {}
+            self.newest = {}
+            removed = [video.id for video in self.videos]
             self.videos = []
-            for user in self.user_list:
-                self.videos.extend(search_user(user, '', 'published', max_results))
-            self.videos.sort(key = lambda video: video.uploaded)
-            self.videos.reverse()
+        seen, newest = self.history()
+        feeds = {user: [video for video in videos if video.id not in seen.get(user, ())] for user, videos in feeds.items()}
+        evicted = set()
+        for user, videos in feeds.items():
+            ids = [video.id for video in videos] + self.seen.get(user, [])
+            evicted.update(ids[history:])
+            self.seen[user] = ids[:history]
+            if (videos):
+                self.newest[user] = max(videos[0].uploaded, newest.get(user, 0))
+        key = lambda video: video.uploaded
+        # every feed is already ordered by upload date so a k-way merge is enough
+        new = heapq.merge(*feeds.values(), key = key, reverse = True)
+        merged = heapq.merge(new, self.videos, key = key, reverse = True)
+        self.videos[:] = [video for video in merged if video.id not in evicted]
+        self.changed()
+        added = [video for videos in feeds.values() for video in videos if video.id not in evicted]
+        return (added, removed + list(evicted))
 
 
+page_classes = {cls.__name__: cls for cls in (BookmarkPage, SearchPage, SubscriptionPage)}
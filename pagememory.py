@@ -0,0 +1,64 @@
+import time
+
+class PageMemory():
+    """Keeps the videos of the pages viewed last in memory, within a budget of
+    bytes. The videos of the other pages are dropped, only their attributes
+    stay, and are loaded again from the store when their page is viewed.
+    Pages whose videos may not all be saved, like ones a search failed to
+    finish, are saved before they are dropped. Nothing is dropped when the
+    store is in memory, its copy would take as much as the videos."""
+
+    def __init__(self, store, budget):
+        self.store = store
+        self.budget = budget
+
+
+    def viewed(self, page):
+        page.viewed = time.monotonic()
+
+
+    def resident(self, pages):
+        """Returns (page, bytes) pairs for the pages with videos in memory,
+        the one viewed last first."""
+
+        resident = [(page, page.resident_size()) for page in pages if getattr(page, 'hydrated', True) and page.videos]
+        resident.sort(key = lambda pair: getattr(pair[0], 'viewed', 0), reverse = True)
+        return resident
+
+
+    def evict(self, pages, busy):
+        """Drops the videos of the pages viewed longest ago until the others
+        fit in the budget. Pages for which busy(page) is true stay, like the
+        open one and ones still loading. Returns the pages dropped."""
+
+        if (self.budget <= 0 or self.store.path == ':memory:'):
+            return []
+        resident = self.resident(pages)
+        total = sum(size for page, size in resident)
+        evicted = []
+        for page, size in reversed(resident):
+            if (total <= self.budget):
+                break
+            if (busy(page)):
+                continue
+            if (getattr(page, 'dirty', False) or not hasattr(page, 'page_id')):
+                self.store.save_page(page)
+            self.store.evict_page(page)
+            total -= size
+            evicted.append(page)
+        return evicted
+
+
+    def report(self, pages):
+        """Returns a line with the size of every page in memory."""
+
+        resident = self.resident(pages)
+        total = sum(size for page, size in resident)
+        line = '%d of %d pages in memory, %s' % (len(resident), len(pages), format_size(total))
+        if (self.budget > 0):
+            line += ' of ' + format_size(self.budget)
+        return line + ': ' + ', '.join(page.format() + ' ' + format_size(size) for page, size in resident)
+
+
+def format_size(size):
+    return '%.1fM' % (size / 2 ** 20)
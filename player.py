@@ -0,0 +1,173 @@
+import json
+import os
+import time
+
+class Player():
+    """Plays videos in one long running mpv, sending it commands over its json
+    ipc socket instead of starting a player for every video. mpv is started on
+    the first play, again if it has quit since, and quits by itself once its
+    playlist is over. With ipc off a player process is started per play like
+    before, and reaped once it exits."""
+
+    def __init__(self, program = 'mpv', args = '', ipc = True, timeout = 5):
+        self.program = program
+        self.args = args
+        self.ipc = ipc
+        self.timeout = timeout
+        self.process = None
+        self.conn = None
+        self.replies = None
+        self.request_id = 0
+        self.processes = []
+        self.socket_dir = None
+
+
+    def configure(self, program, args, ipc):
+        """Changes the player, the running one is used until it quits."""
+
+        self.program = program
+        self.args = args
+        self.ipc = ipc
+
+
+    def running(self):
+        """Returns whether the player is still running, reaping it if not."""
+
+        return self.process is not None and self.process.poll() is None
+
+
+    def reap(self):
+        """Waits on the players started per play that have exited."""
+
+        self.processes = [process for process in self.processes if process.poll() is None]
+
+
+    def spawn(self, args):
+        # imported on first play to keep start up fast
+        import subprocess
+        return subprocess.Popen([self.program] + self.args.split() + args, stdin = subprocess.DEVNULL,
+                                stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+
+    def start(self):
+        """Starts the player and connects to its socket."""
+
+        if (self.running()):
+            # the socket broke without the player quitting
+            self.stop()
+        self.disconnect()
+        import socket
+        import tempfile
+        if (self.socket_dir is None):
+            self.socket_dir = tempfile.mkdtemp(prefix = 'yaytp')
+        path = os.path.join(self.socket_dir, 'player.sock')
+        if (os.path.exists(path)):
+            os.remove(path)
+        self.process = self.spawn(['--idle=once', '--input-ipc-server=' + path])
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                conn.connect(path)
+                break
+            except OSError:
+                conn.close()
+                if (not self.running() or time.monotonic() > deadline):
+                    self.stop()
+                    raise OSError('could not start ' + self.program)
+                time.sleep(0.02)
+        conn.settimeout(self.timeout)
+        self.conn = conn
+        self.replies = conn.makefile('rb')
+
+
+    def disconnect(self):
+        if (self.conn is not None):
+            self.replies.close()
+            self.conn.close()
+            self.conn = None
+            self.replies = None
+
+
+    def send(self, *command):
+        """Sends a command and returns the data of its reply. Raises OSError
+        if the player is gone and RuntimeError if it refused the command."""
+
+        self.request_id += 1
+        message = {'command': list(command), 'request_id': self.request_id}
+        self.conn.sendall(json.dumps(message).encode() + b'\n')
+        while True:
+            line = self.replies.readline()
+            if (not line):
+                raise ConnectionError('player closed its socket')
+            reply = json.loads(line)
+            # events are sent on the same socket, skip them
+            if (reply.get('request_id') == self.request_id):
+                break
+        if (reply.get('error', 'success') != 'success'):
+            raise RuntimeError(command[0] + ': ' + reply['error'])
+        return reply.get('data')
+
+
+    def command(self, *command):
+        """Sends a command, starting the player first if it is not running."""
+
+        if (self.conn is None or not self.running()):
+            self.start()
+        try:
+            return self.send(*command)
+        except OSError:
+            # the player quit since the last command, start a new one
+            self.start()
+            return self.send(*command)
+
+
+    def play(self, urls, append = False):
+        """Plays urls in order, replacing what is playing or appended to the
+        playlist."""
+
+        if (not urls):
+            return
+        if (not self.ipc):
+            self.reap()
+            self.processes.append(self.spawn(list(urls)))
+            return
+        self.command('loadfile', urls[0], 'append-play' if append else 'replace')
+        for url in urls[1:]:
+            self.command('loadfile', url, 'append')
+
+
+    def stop(self):
+        """Quits the player."""
+
+        if (self.conn is not None):
+            try:
+                self.send('quit')
+            except (OSError, RuntimeError, ValueError):
+                pass
+        self.disconnect()
+        if (self.process is not None):
+            import subprocess
+            try:
+                self.process.wait(self.timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        self.remove_socket_dir()
+
+
+    def close(self):
+        """Lets the player finish its playlist on its own."""
+
+        self.disconnect()
+        self.reap()
+        # a running player keeps playing without its socket
+        self.remove_socket_dir()
+
+
+    def remove_socket_dir(self):
+        if (self.socket_dir is not None):
+            import shutil
+            shutil.rmtree(self.socket_dir, ignore_errors = True)
+            self.socket_dir = None
@@ -0,0 +1,174 @@
+import threading
+import zlib
+
+class Response():
+    """A response from a pooled connection. The connection is handed back to the
+    pool once the body has been read."""
+
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.released = False
+
+
+    def release(self, reuse = False):
+        """Hands the connection back to the pool, closing it unless reuse is set
+        and the server keeps it open."""
+
+        if (not self.released):
+            self.released = True
+            self.pool.release(self.key, self.conn, reuse and not self.response.will_close)
+
+
+    def iter_chunks(self, size = 16384):
+        """Yields the decompressed body as it arrives. If the body is not read
+        to the end the connection is closed instead of reused."""
+
+        encoding = self.headers.get('Content-Encoding', '').strip().lower()
+        # wbits of 32 + MAX_WBITS accepts both gzip and zlib headers
+        decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS) if encoding in ('gzip', 'deflate') else None
+        finished = False
+        try:
+            while True:
+                chunk = self.response.read1(size)
+                if (not chunk):
+                    break
+                if (decompressor is not None):
+                    chunk = decompressor.decompress(chunk)
+                if (chunk):
+                    yield chunk
+            # read1 leaves a response with a content length open after its
+            # last byte, which keeps the connection from being reused
+            self.response.read()
+            if (decompressor is not None):
+                chunk = decompressor.flush()
+                if (chunk):
+                    yield chunk
+            finished = True
+        finally:
+            self.release(reuse = finished)
+
+
+    def read(self):
+        """Reads and decompresses the whole body."""
+
+        return b''.join(self.iter_chunks())
+
+
+class ConnectionPool():
+    """A thread safe pool of keep-alive connections, reused per host."""
+
+    def __init__(self, max_connections = 4, timeout = None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle = {}
+        self.active = 0
+        self.opened = 0
+        self.lock = threading.Condition()
+
+
+    def resize(self, max_connections):
+        """Changes the maximum number of open connections."""
+
+        with self.lock:
+            self.max_connections = max(1, max_connections)
+            self.trim()
+            self.lock.notify_all()
+
+
+    def idle_count(self):
+        """Returns the number of idle connections."""
+
+        return sum(len(conns) for conns in self.idle.values())
+
+
+    def trim(self):
+        """Closes idle connections until the pool is within its limit. Must be
+        called with the lock held."""
+
+        for key in list(self.idle):
+            while (self.idle[key] and self.active + self.idle_count() > self.max_connections):
+                self.idle[key].pop(0).close()
+            if (not self.idle[key]):
+                del self.idle[key]
+
+
+    def acquire(self, key, timeout):
+        """Returns a connection to a host, reusing an idle one if possible.
+        The second entry of the returned tuple is whether it was reused."""
+
+        with self.lock:
+            while (not self.idle.get(key) and self.active >= self.max_connections):
+                self.lock.wait()
+            self.active += 1
+            if (self.idle.get(key)):
+                return (self.idle[key].pop(), True)
+            # make room by closing connections idle on other hosts
+            self.trim()
+            self.opened += 1
+        # imported on first use, it is slow to import and not needed to start
+        import http.client
+        scheme, host = key
+        if (scheme == 'https'):
+            conn = http.client.HTTPSConnection(host, timeout = timeout)
+        else:
+            conn = http.client.HTTPConnection(host, timeout = timeout)
+        return (conn, False)
+
+
+    def release(self, key, conn, reuse = True):
+        """Hands a connection back to the pool."""
+
+        with self.lock:
+            self.active -= 1
+            if (reuse):
+                self.idle.setdefault(key, []).append(conn)
+                self.trim()
+            else:
+                conn.close()
+            self.lock.notify()
+
+
+    def request(self, url, headers = None, timeout = None):
+        """Performs a GET request and returns a Response. Raises HTTPError on
+        an error status like urlopen does."""
+
+        import http.client
+        import urllib.error
+        import urllib.parse
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if (parts.query):
+            path += '?' + parts.query
+        request_headers = {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+        request_headers.update(headers or {})
+        timeout = timeout if timeout is not None else self.timeout
+        while True:
+            conn, reused = self.acquire(key, timeout)
+            try:
+                if (conn.sock is not None):
+                    conn.sock.settimeout(timeout)
+                conn.timeout = timeout
+                conn.request('GET', path, headers = request_headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.release(key, conn, reuse = False)
+                # the server dropped an idle connection, retry on a fresh one
+                if (reused):
+                    continue
+                raise
+            except Exception:
+                self.release(key, conn, reuse = False)
+                raise
+            break
+        result = Response(self, key, conn, response)
+        if (result.status >= 400):
+            result.read()
+            raise urllib.error.HTTPError(url, result.status, result.reason, result.headers, None)
+        return result
@@ -1,15 +1,35 @@
+import codecs
 import json
-import urllib.request
+import re
+import time
 import urllib.parse
+from cache import ResponseCache
+from library import Library
+from pool import ConnectionPool
+from scheduler import Scheduler
+from timing import timings
 from video import *
 
-def make_query(term, order, max_results):
+pool = ConnectionPool()
+scheduler = Scheduler(pool)
+cache = ResponseCache()
+library = Library()
+api_base = 'https://gdata.youtube.com/feeds/api'
+
+def set_api_base(url):
+    """Changes the server searches are sent to, for example a local fakeserver.py."""
+
+    global api_base
+    api_base = url.rstrip('/')
+
+
+def make_query(term, order, max_results, start_index = 1):
     """ Makes the query for the search."""
     query = {
         'q': term,
         'v': 2,
         'alt': 'jsonc',
-        'start-index': 1,
+        'start-index': start_index,
         'safeSearch': "none",
         'max-results': max_results, 
         'paid-content': "false",
@@ -18,32 +38,264 @@ def make_query(term, order, max_results):
     return query;
 
 
-def search(urlbase, term, order, max_results):
-    """Helper function for performing a search."""
+def fetch_chunks(url, kind, timeout = None, deadline = None):
+    """Fetches a url like fetch_cached_chunks, except that a url already
+    being fetched is not requested again, the body of that fetch is used."""
 
-    query = make_query(term, order, max_results)
-    url = urlbase + "?" + urllib.parse.urlencode(query)
-    result = urllib.request.urlopen(url).read().decode("utf8")
+    return scheduler.single_flight(url, lambda: fetch_cached_chunks(url, kind, timeout, deadline))
+
+
+def fetch_cached_chunks(url, kind, timeout = None, deadline = None):
+    """Fetches a url through the response cache, yielding the body as it
+    arrives. Fresh entries are served without a request, stale ones are
+    revalidated with the server and served as they are when the network is
+    down or the cache is in offline mode. deadline is passed on to
+    Scheduler.request.
+    """
+
+    import urllib.error
+
+    if (not cache.enabled()):
+        with timings.phase('connect'):
+            response = scheduler.request(url, timeout = timeout, deadline = deadline)
+        yield from response.iter_chunks()
+        return
+    with timings.phase('cache'):
+        entry = cache.get(url)
+    if (entry is not None and (cache.offline or cache.is_fresh(entry, kind))):
+        cache.hits += 1
+        yield entry[0]
+        return
+    if (cache.offline):
+        cache.misses += 1
+        raise urllib.error.URLError('offline and ' + url + ' is not cached')
+    headers = {}
+    if (entry is not None):
+        if (entry[1]):
+            headers['If-None-Match'] = entry[1]
+        if (entry[2]):
+            headers['If-Modified-Since'] = entry[2]
     try:
-        items = json.loads(result)['data']['items']
-        videos = []
-        for video in items:
-            videos.append(Video(video))
-    except KeyError:
-        videos = []
-    return videos
+        with timings.phase('connect'):
+            response = scheduler.request(url, headers, timeout, deadline)
+    except urllib.error.HTTPError:
+        raise
+    except OSError:
+        if (entry is None):
+            raise
+        cache.hits += 1
+        yield entry[0]
+        return
+    if (response.status == 304 and entry is not None):
+        response.read()
+        cache.revalidated(url)
+        cache.hits += 1
+        yield entry[0]
+        return
+    # the body is kept so it can be cached once it is complete
+    body = []
+    for chunk in response.iter_chunks():
+        body.append(chunk)
+        yield chunk
+    cache.misses += 1
+    with timings.phase('cache'):
+        cache.put(url, b''.join(body), response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+items_start = re.compile(r'"items"\s*:\s*\[')
+
+def iter_items(chunks):
+    """Yields the entries of data.items of a jsonc response one at a time,
+    decoding each one as soon as all of it has arrived."""
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf8')()
+    chunks = iter(chunks)
+    buffer = ''
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        match = items_start.search(buffer)
+        if (match):
+            buffer = buffer[match.end():]
+            break
+        # keep enough to match a key split between chunks
+        buffer = buffer[-32:]
+    else:
+        return
+    while True:
+        pos = 0
+        while (pos < len(buffer) and buffer[pos] in ' \t\r\n,'):
+            pos += 1
+        if (pos < len(buffer)):
+            if (buffer[pos] == ']'):
+                # read the rest so the response can be cached and the
+                # connection reused
+                for chunk in chunks:
+                    pass
+                return
+            try:
+                with timings.phase('decode'):
+                    item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                pass
+            else:
+                buffer = buffer[end:]
+                yield item
+                continue
+        # the next item has not fully arrived yet
+        chunk = next(chunks, None)
+        if (chunk is None):
+            return
+        buffer = buffer[pos:] + utf8.decode(chunk)
+
+
+def stream_search(urlbase, term, order, max_results, timeout = None, kind = 'term', start_index = 1, deadline = None):
+    """Performs a search, yielding videos as they arrive."""
+
+    query = make_query(term, order, max_results, start_index)
+    url = urlbase + "?" + urllib.parse.urlencode(query)
+    videos = []
+    with timings.measure('search', kind = kind, results = max_results):
+        try:
+            for item in iter_items(timings.iterate(fetch_chunks(url, kind, timeout, deadline), 'transfer')):
+                try:
+                    with timings.phase('build'):
+                        video = make_video(item)
+                except KeyError:
+                    continue
+                videos.append(video)
+                yield video
+        finally:
+            with timings.phase('library'):
+                library.record(videos)
+
+
+def search(urlbase, term, order, max_results, timeout = None, kind = 'term', start_index = 1, deadline = None):
+    """Helper function for performing a search."""
+
+    return list(stream_search(urlbase, term, order, max_results, timeout, kind, start_index, deadline))
+
 
+def user_url(user):
+    """Returns the url of a user's uploads."""
 
-def search_user(user, term, order, max_results):
+    return api_base + '/users/%s/uploads' % urllib.parse.quote(user)
+
+
+def term_url():
+    """Returns the url of a search on all videos."""
+
+    return api_base + '/videos'
+
+
+def search_user(user, term, order, max_results, timeout = None, start_index = 1, deadline = None):
     """Performs a search on a user's uploads."""
 
-    urlbase = 'https://gdata.youtube.com/feeds/api/users/%s/uploads' % user
-    return search(urlbase, term, order, max_results);
+    return search(user_url(user), term, order, max_results, timeout, 'user', start_index, deadline);
+
 
+def search_user_since(user, known, newest, max_results, chunk = 5, timeout = None, deadline = None):
+    """Fetches a user's uploads newer than the ones already known, a few at a
+    time, stopping at the first known id or upload time. Returns them newest first.
+    Without any history there is nothing to stop at, so every upload wanted
+    is fetched in one request. No request is sent or retried after deadline.
+    """
 
-def search_term(term, order, max_results):
+    if (not known and newest is None):
+        chunk = max_results
+    videos = []
+    while (len(videos) < max_results):
+        count = min(chunk, max_results - len(videos))
+        batch = search_user(user, '', 'published', count, timeout, len(videos) + 1, deadline)
+        for video in batch:
+            if (video.id in known or (newest is not None and video.uploaded <= newest)):
+                return videos
+            videos.append(video)
+        if (len(batch) < count):
+            break
+        # the gap since the last refresh is likely larger, fetch bigger chunks
+        chunk *= 2
+    return videos
+
+
+def fetch_users(users, fetch, workers = 8, timeout = None):
+    """Calls fetch(user, timeout, deadline) for several users concurrently,
+    deadline being timeout seconds after the fetch of the user starts, so
+    that the requests and retries of one user take at most that long.
+    Returns a tuple with the first entry being a dict of results by user and
+    the second a list of users whose fetch failed or timed out.
+    """
+
+    # imported on first use, it is slow to import and not needed to start
+    from concurrent.futures import ThreadPoolExecutor
+    results = {}
+    failed = []
+    def timed_fetch(user, timeout):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with timings.measure('refresh user', show = False, user = user):
+            return fetch(user, timeout, deadline)
+    with ThreadPoolExecutor(max_workers = max(1, workers)) as executor:
+        futures = [(user, executor.submit(timed_fetch, user, timeout)) for user in users]
+        for user, future in futures:
+            try:
+                results[user] = future.result()
+            except Exception:
+                failed.append(user)
+    return (results, failed)
+
+
+def search_term(term, order, max_results, timeout = None):
     """Performs a search on a term."""
 
-    urlbase = 'https://gdata.youtube.com/feeds/api/videos'
-    return search(urlbase, term, order, max_results);
+    return search(term_url(), term, order, max_results, timeout);
+
+
+class ResultStream():
+    """The results of a search, fetched one chunk at a time as they are needed."""
+
+    # the api refuses larger pages and start indexes past this
+    max_chunk = 50
+    max_index = 1000
+
+    def __init__(self, urlbase, term, order, chunk, kind = 'term'):
+        self.urlbase = urlbase
+        self.term = term
+        self.order = order
+        self.chunk = max(1, min(chunk, self.max_chunk))
+        self.kind = kind
+        self.next_index = 1
+        self.exhausted = False
+
+
+    def fetch_next(self, job = None, timeout = None):
+        """Fetches the next chunk of results. When run as a job each video is
+        reported as it arrives and the fetch stops if the job is cancelled.
+        With a timeout the request and its retries give up after that many
+        seconds."""
+
+        if (self.exhausted):
+            return []
+        videos = []
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for video in stream_search(self.urlbase, self.term, self.order, self.chunk, timeout, self.kind, self.next_index, deadline):
+            if (job is not None):
+                if (job.cancelled.is_set()):
+                    return videos
+                job.report(video)
+            videos.append(video)
+        self.next_index += self.chunk
+        if (len(videos) < self.chunk or self.next_index > self.max_index):
+            self.exhausted = True
+        return videos
+
+
+def user_stream(user, term, order, chunk):
+    """Returns a stream of a user's uploads."""
+
+    return ResultStream(user_url(user), term, order, chunk, 'user')
+
+
+def term_stream(term, order, chunk):
+    """Returns a stream of search results for a term."""
 
+    return ResultStream(term_url(), term, order, chunk)
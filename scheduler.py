@@ -0,0 +1,177 @@
+import random
+import threading
+import time
+
+class Flight():
+    """A fetch in progress that other identical fetches follow. Its chunks are
+    only kept once a follower joined."""
+
+    def __init__(self, lock):
+        self.changed = threading.Condition(lock)
+        self.followers = 0
+        self.chunks = []
+        self.finished = False
+        self.complete = False
+        self.error = None
+
+
+class Scheduler():
+    """Sends requests through a connection pool, limiting their rate with a
+    token bucket and retrying the ones that failed in a way that may pass
+    with exponential backoff. Identical fetches in flight at the same time
+    are sent once, the later ones follow the chunks of the first."""
+
+    # statuses worth trying again
+    transient_statuses = (408, 429, 500, 502, 503, 504)
+
+    def __init__(self, pool, rate = 20, burst = 100, retries = 3, backoff = 0.5, max_backoff = 8):
+        self.pool = pool
+        self.configure(rate, burst, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.retried = 0
+        self.coalesced = 0
+
+
+    def configure(self, rate, burst, retries):
+        """Changes the requests allowed per second, how many can be sent at
+        once after a quiet period and how many times a request is retried.
+        A rate of 0 sends requests as they come."""
+
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.retries = retries
+
+
+    def take_token(self):
+        """Waits until the rate allows another request."""
+
+        while (self.rate > 0):
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if (self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+    def retry_delay(self, error, attempt):
+        """Returns how long to wait before trying a failed request again, or
+        None if it should not be."""
+
+        import http.client
+        import urllib.error
+        if (attempt >= self.retries):
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if (isinstance(error, urllib.error.HTTPError)):
+            if (error.code not in Scheduler.transient_statuses):
+                return None
+            retry_after = error.headers.get('Retry-After', '') if error.headers else ''
+            if (retry_after.isdigit()):
+                return min(self.max_backoff, int(retry_after))
+        elif (not isinstance(error, (OSError, http.client.HTTPException))):
+            return None
+        # jitter keeps clients that failed together from retrying together
+        return delay * random.uniform(0.5, 1)
+
+
+    def request(self, url, headers = None, timeout = None, deadline = None):
+        """Performs a GET request like ConnectionPool.request, waiting for the
+        rate limit and retrying transient failures. deadline is a time of
+        time.monotonic() after which no attempt is made or waited for, and
+        no read waits past it."""
+
+        attempt = 0
+        while True:
+            if (deadline is not None):
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0):
+                    raise TimeoutError('timed out fetching ' + url)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            self.take_token()
+            try:
+                return self.pool.request(url, headers, timeout)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if (delay is None or (deadline is not None and time.monotonic() + delay >= deadline)):
+                    raise
+            attempt += 1
+            self.retried += 1
+            time.sleep(delay)
+
+
+    def single_flight(self, key, fetch):
+        """Yields the chunks of the iterable returned by fetch(). If a fetch
+        with the same key is in flight and was joined before its first chunk,
+        yields the chunks of that fetch as they arrive instead. A fetch
+        nobody joined by then is streamed without keeping its chunks, and
+        identical fetches after that are sent again."""
+
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if (leader):
+                flight = self.flights[key] = Flight(self.lock)
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+        if (not leader):
+            yield from self.follow(flight, fetch)
+            return
+        try:
+            for chunk in fetch():
+                with self.lock:
+                    if (flight.followers):
+                        flight.chunks.append(chunk)
+                        flight.changed.notify_all()
+                    elif (self.flights.get(key) is flight):
+                        del self.flights[key]
+                yield chunk
+            flight.complete = True
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if (self.flights.get(key) is flight):
+                    del self.flights[key]
+                flight.finished = True
+                flight.changed.notify_all()
+
+
+    def follow(self, flight, fetch):
+        """Yields the chunks of a flight as they arrive. If its fetch stops
+        before it is complete, the rest is fetched again."""
+
+        index = 0
+        sent = 0
+        while True:
+            with self.lock:
+                while (index == len(flight.chunks) and not flight.finished):
+                    flight.changed.wait()
+                chunks = flight.chunks[index:]
+                finished = index + len(chunks) == len(flight.chunks) and flight.finished
+            index += len(chunks)
+            for chunk in chunks:
+                sent += len(chunk)
+                yield chunk
+            if (finished):
+                break
+        if (flight.error is not None):
+            raise flight.error
+        if (not flight.complete):
+            # the first fetch was abandoned, skip what was already yielded
+            for chunk in fetch():
+                if (sent >= len(chunk)):
+                    sent -= len(chunk)
+                    continue
+                yield chunk[sent:]
+                sent = 0
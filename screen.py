@@ -0,0 +1,81 @@
+import curses
+
+class Screen():
+    """Holds the windows of the ui across frames. Rows are given as lists of
+    (x, text, attr) segments and only repainted when they changed since the
+    last frame, and all windows are copied to the terminal in one update."""
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.size = None
+        self.windows = {}
+        self.rows = {}
+        self.touched = set()
+
+
+    def layout(self):
+        """Creates the windows, again if the terminal was resized."""
+
+        size = self.stdscr.getmaxyx()
+        if (size == self.size):
+            return
+        self.size = size
+        h, w = size
+        self.stdscr.erase()
+        self.stdscr.noutrefresh()
+        self.windows = {
+            'main': curses.newwin(max(h - 2, 1), w, 0, 0),
+            'page_bar': curses.newwin(1, w, max(h - 2, 0), 0),
+            'status_bar': curses.newwin(1, w, max(h - 1, 0), 0),
+        }
+        self.rows = {}
+        self.touched = set(self.windows)
+
+
+    def put(self, name, y, segments):
+        """Sets the content of a row of a window."""
+
+        key = (name, y)
+        if (self.rows.get(key) == segments):
+            return
+        win = self.windows[name]
+        win.move(y, 0)
+        win.clrtoeol()
+        for x, text, attr in segments:
+            try:
+                win.addstr(y, x, text, attr)
+            except curses.error:
+                # text running off the window is cut, the bottom right
+                # corner always raises
+                pass
+        self.rows[key] = segments
+        self.touched.add(name)
+
+
+    def clear_rows(self, name, start):
+        """Clears the rows of a window from start down."""
+
+        h, w = self.windows[name].getmaxyx()
+        for y in range(start, h):
+            if (self.rows.pop((name, y), None)):
+                self.windows[name].move(y, 0)
+                self.windows[name].clrtoeol()
+                self.touched.add(name)
+
+
+    def forget(self, name):
+        """Drops what is known about a window that was drawn on directly."""
+
+        for key in [key for key in self.rows if key[0] == name]:
+            del self.rows[key]
+        self.windows[name].erase()
+        self.touched.add(name)
+
+
+    def flush(self):
+        """Copies the windows that changed to the terminal."""
+
+        for name in self.touched:
+            self.windows[name].noutrefresh()
+        self.touched = set()
+        curses.doupdate()
@@ -0,0 +1,317 @@
+import contextlib
+import fcntl
+import json
+import pickle
+import sqlite3
+import time
+from video import *
+
+class Store():
+    """Persists the session in an SQLite database one change at a time.
+    Every write is its own transaction, so a crash loses at most the change
+    that was being written. Videos are saved once in the videos table and
+    pages refer to them by id. Uploads fetched by daemon.py wait in the
+    prefetched table until the ui merges them into its subscriptions."""
+
+    def __init__(self, path = 'session.db'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('pragma journal_mode = wal')
+        self.db.execute('pragma synchronous = normal')
+        with self.db:
+            self.db.execute('create table if not exists meta (key text primary key, value blob)')
+            self.db.execute('create table if not exists pages (id integer primary key, position integer, class text, state blob)')
+            self.db.execute('create table if not exists page_videos (page_id integer, seq real, video_id text, data text)')
+            self.db.execute('create index if not exists page_videos_seq on page_videos (page_id, seq)')
+            self.db.execute('create index if not exists page_videos_id on page_videos (page_id, video_id)')
+            self.db.execute('create table if not exists videos (id text primary key, data text)')
+            self.db.execute('create table if not exists prefetched (user text, video_id text, fetched real, uploaded integer)')
+            if ('uploaded' not in [row[1] for row in self.db.execute('pragma table_info(prefetched)')]):
+                self.db.execute('alter table prefetched add column uploaded integer')
+            self.db.execute('create index if not exists prefetched_user on prefetched (user)')
+            # sessions saved before kept the data of every video with the page
+            if (self.db.execute('select 1 from page_videos where data is not null limit 1').fetchone()):
+                self.db.execute('insert or replace into videos select video_id, data from page_videos where data is not null')
+                self.db.execute('update page_videos set data = null')
+
+
+    def is_empty(self):
+        return self.db.execute('select count(*) from pages').fetchone()[0] == 0
+
+
+    def get_meta(self, key, default = None):
+        row = self.db.execute('select value from meta where key = ?', (key,)).fetchone()
+        return pickle.loads(row[0]) if row is not None else default
+
+
+    def set_meta(self, key, value):
+        with self.db:
+            self.db.execute('insert or replace into meta values (?, ?)', (key, pickle.dumps(value)))
+
+
+    def load_pages(self, classes, hydrate = None):
+        """Returns the saved pages in order. classes maps the class names of
+        pages to the classes to create. If hydrate is given only the videos
+        of the pages at those indexes are loaded, the others have no videos
+        until passed to hydrate_page."""
+
+        pages = []
+        for i, (page_id, class_name, state) in enumerate(self.db.execute('select id, class, state from pages order by position').fetchall()):
+            cls = classes[class_name]
+            page = cls.__new__(cls)
+            page.__dict__.update(pickle.loads(state))
+            page.page_id = page_id
+            page.videos = []
+            page.hydrated = False
+            if (hydrate is None or i in hydrate):
+                self.hydrate_page(page)
+            pages.append(page)
+        return pages
+
+
+    def hydrate_page(self, page):
+        """Loads the videos of a page loaded without them."""
+
+        if (not page.hydrated):
+            rows = self.load_videos(page.page_id)
+            page.videos = [video for seq, video in rows]
+            page.changed()
+            if (hasattr(page, 'set_ranks')):
+                page.set_ranks([seq for seq, video in rows])
+            page.hydrated = True
+
+
+    def evict_page(self, page):
+        """Drops the videos of a page from memory, and what was built from
+        them, so that the page is like one loaded without them. Its videos
+        must be saved."""
+
+        for name in getattr(page, 'transient', ()):
+            if (name != 'viewed' and hasattr(page, name)):
+                delattr(page, name)
+        page.videos = []
+        page.hydrated = False
+
+
+    def load_states(self, class_name):
+        """Returns the saved attributes of the pages of a class in order,
+        without loading their videos."""
+
+        rows = self.db.execute('select state from pages where class = ? order by position', (class_name,))
+        return [pickle.loads(state) for state, in rows]
+
+
+    def load_videos(self, page_id):
+        """Returns the (seq, video) pairs of a page in order."""
+
+        rows = self.db.execute('select seq, videos.data from page_videos join videos on videos.id = page_videos.video_id '
+                               'where page_id = ? order by seq', (page_id,))
+        return [(seq, make_video(json.loads(data), update = False)) for seq, data in rows]
+
+
+    def page_state(self, page):
+        skip = ('videos', 'page_id') + getattr(page, 'transient', ())
+        return pickle.dumps({key: value for key, value in vars(page).items() if key not in skip})
+
+
+    def write_state(self, page):
+        """Writes the attributes of a page other than its videos, adding the page
+        if it is new. Must be called inside a transaction."""
+
+        if (hasattr(page, 'page_id')):
+            self.db.execute('update pages set state = ? where id = ?', (self.page_state(page), page.page_id))
+        else:
+            cursor = self.db.execute('insert into pages (position, class, state) values (0, ?, ?)', (type(page).__name__, self.page_state(page)))
+            page.page_id = cursor.lastrowid
+
+
+    def save_state(self, page):
+        """Saves the attributes of a page other than its videos."""
+
+        with self.db:
+            self.write_state(page)
+
+
+    def save_states(self, pages):
+        """Saves the attributes of several pages in one transaction."""
+
+        with self.db:
+            for page in pages:
+                self.write_state(page)
+
+
+    def save_page(self, page):
+        """Saves a page along with all of its videos."""
+
+        with self.db:
+            self.write_state(page)
+            if (not getattr(page, 'hydrated', True)):
+                # its videos were never loaded so they did not change
+                return
+            self.db.execute('delete from page_videos where page_id = ?', (page.page_id,))
+            self.insert_videos(page.page_id, page.videos, 0)
+        page.dirty = False
+
+
+    def save_merged(self, page, added, removed):
+        """Saves the changes merge_subs made to a page: deletes the ids removed
+        and inserts the videos added, leaving the other rows as they are. The
+        rows are ordered by upload time, so new ones need no room made for
+        them. Pages saved in another order are saved whole the first time."""
+
+        with self.db:
+            self.write_state(page)
+            if (not getattr(page, 'hydrated', True)):
+                return
+            # pages saved in order number their rows from 0 up
+            if (self.db.execute('select 1 from page_videos where page_id = ? and seq >= 0 limit 1', (page.page_id,)).fetchone()):
+                self.db.execute('delete from page_videos where page_id = ?', (page.page_id,))
+                added = page.videos
+            else:
+                self.db.executemany('delete from page_videos where page_id = ? and video_id = ?', [(page.page_id, id) for id in removed])
+            self.insert_rows(page.page_id, [(upload_seq(video), video) for video in added])
+        page.dirty = False
+
+
+    def append_videos(self, page, videos):
+        """Saves videos added to the end of a page."""
+
+        with self.db:
+            self.write_state(page)
+            last = self.db.execute('select max(seq) from page_videos where page_id = ?', (page.page_id,)).fetchone()[0]
+            self.insert_videos(page.page_id, videos, last + 1 if last is not None else 0)
+
+
+    def save_ranks(self, page, changes):
+        """Saves the seq of the (video, seq) pairs of a page, adding the videos
+        that are not saved yet."""
+
+        with self.db:
+            self.write_state(page)
+            for video, seq in changes:
+                cursor = self.db.execute('update page_videos set seq = ? where page_id = ? and video_id = ?', (seq, page.page_id, video.id))
+                if (cursor.rowcount == 0):
+                    self.insert_videos(page.page_id, [video], seq)
+
+
+    def delete_videos(self, page, videos):
+        """Deletes videos from a saved page."""
+
+        with self.db:
+            self.write_state(page)
+            self.db.executemany('delete from page_videos where page_id = ? and video_id = ?', [(page.page_id, video.id) for video in videos])
+
+
+    def insert_videos(self, page_id, videos, seq):
+        self.insert_rows(page_id, [(seq + i, video) for i, video in enumerate(videos)])
+
+
+    def insert_rows(self, page_id, rows):
+        """Inserts the (seq, video) pairs of a page."""
+
+        self.db.executemany('insert into page_videos (page_id, seq, video_id) values (?, ?, ?)',
+                            [(page_id, seq, video.id) for seq, video in rows])
+        self.db.executemany('insert or replace into videos values (?, ?)', [(video.id, json.dumps(video.to_data())) for seq, video in rows])
+
+
+    def prune(self):
+        """Deletes the videos that no page refers to anymore. Must be called
+        inside a transaction."""
+
+        self.db.execute('delete from videos where id not in (select video_id from page_videos) and id not in (select video_id from prefetched)')
+
+
+    def delete_page(self, page):
+        if (hasattr(page, 'page_id')):
+            with self.db:
+                self.db.execute('delete from page_videos where page_id = ?', (page.page_id,))
+                self.db.execute('delete from pages where id = ?', (page.page_id,))
+
+
+    def save_order(self, pages, page_index):
+        """Saves the order of the pages and which one is open."""
+
+        with self.db:
+            for page in pages:
+                if (not hasattr(page, 'page_id')):
+                    self.write_state(page)
+            self.db.executemany('update pages set position = ? where id = ?', [(i, page.page_id) for i, page in enumerate(pages)])
+            self.prune()
+            self.db.execute('insert or replace into meta values (?, ?)', ('page_index', pickle.dumps(page_index)))
+
+
+    def locked(self):
+        """Returns a context manager holding a lock on the session, shared with
+        the other processes using it, so that one does not save over what
+        another read and is about to change."""
+
+        if (self.path == ':memory:'):
+            return contextlib.nullcontext()
+        return file_lock(self.path + '.lock')
+
+
+    def add_prefetched(self, user, videos):
+        """Saves uploads of a user fetched in the background."""
+
+        now = time.time()
+        with self.db:
+            self.db.executemany('insert into prefetched values (?, ?, ?, ?)', [(user, video.id, now, video.uploaded) for video in videos])
+            self.db.executemany('insert or replace into videos values (?, ?)', [(video.id, json.dumps(video.to_data())) for video in videos])
+
+
+    def prefetched_ids(self, user):
+        """Returns the ids of the uploads of a user fetched in the background and
+        the upload time of the newest of them, without loading the videos."""
+
+        rows = self.db.execute('select video_id, uploaded from prefetched where user = ?', (user,)).fetchall()
+        # rows saved by older versions have no upload time
+        times = [uploaded for id, uploaded in rows if uploaded is not None]
+        return ({id for id, uploaded in rows}, max(times) if times else None)
+
+
+    def load_prefetched(self, take = False):
+        """Returns the uploads fetched in the background by user, newest first.
+        If take is set they are removed."""
+
+        with self.db:
+            rows = self.db.execute('select user, videos.data from prefetched join videos on videos.id = prefetched.video_id').fetchall()
+            if (take):
+                self.db.execute('delete from prefetched')
+        feeds = {}
+        for user, data in rows:
+            feeds.setdefault(user, []).append(make_video(json.loads(data), update = False))
+        for videos in feeds.values():
+            videos.sort(key = lambda video: video.uploaded, reverse = True)
+        return feeds
+
+
+    def save_session(self, pages, page_index, settings):
+        """Saves a whole session, used when importing an old session file."""
+
+        for page in pages:
+            self.save_page(page)
+        self.save_order(pages, page_index)
+        self.set_meta('settings', settings)
+
+
+    def close(self):
+        self.db.close()
+
+
+def upload_seq(video):
+    """Returns the seq of a video on a page ordered newest first, below the
+    seqs of pages saved in order."""
+
+    return -video.uploaded - 1
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on a file, waiting for other processes."""
+
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
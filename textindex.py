@@ -0,0 +1,99 @@
+import re
+
+word = re.compile(r'\w+')
+
+def tokenize(text):
+    """Splits text into lower case words."""
+
+    return word.findall(text.casefold())
+
+
+class TextIndex():
+    """An index from the words in the title, description and uploader of videos
+    to the ids of the videos containing them. A term matches a video if it is
+    part of one of its words."""
+
+    def __init__(self):
+        self.postings = {}
+        self.tokens = {}
+        # the title and description each video was indexed with
+        self.texts = {}
+        # words that contain a term, for the last few terms searched
+        self.matches = {}
+
+
+    def sync(self, videos):
+        """Brings the index up to date with a list of videos, only indexing the
+        ones that were added or whose title or description changed and
+        dropping the ones that were removed."""
+
+        ids = {video.id for video in videos}
+        for id in [id for id in self.tokens if id not in ids]:
+            self.remove(id)
+        for video in videos:
+            text = self.texts.get(video.id)
+            if (text != (video.title, video.description)):
+                if (text is not None):
+                    # updated in place since it was indexed
+                    self.remove(video.id)
+                self.add(video)
+
+
+    def add(self, video):
+        tokens = set(tokenize(video.title + ' ' + video.description + ' ' + video.user))
+        self.tokens[video.id] = tokens
+        self.texts[video.id] = (video.title, video.description)
+        for token in tokens:
+            if (token not in self.postings):
+                self.postings[token] = set()
+                self.matches = {}
+            self.postings[token].add(video.id)
+
+
+    def remove(self, id):
+        del self.texts[id]
+        for token in self.tokens.pop(id):
+            posting = self.postings[token]
+            posting.discard(id)
+            if (not posting):
+                del self.postings[token]
+        self.matches = {}
+
+
+    def words_containing(self, term):
+        """Returns the indexed words containing a term."""
+
+        if (term not in self.matches):
+            # a word containing the term contains the term without its last letter
+            shorter = self.matches.get(term[:-1])
+            words = shorter if shorter is not None else self.postings
+            if (len(self.matches) > 64):
+                self.matches = {}
+            self.matches[term] = [token for token in words if term in token]
+        return self.matches[term]
+
+
+    def search_term(self, term):
+        ids = set()
+        for token in self.words_containing(term):
+            ids |= self.postings[token]
+        return ids
+
+
+    def search(self, query, within = None):
+        """Returns the ids of the videos matching a query. Words of a query must
+        all match, unless separated by | which matches either side. If within is
+        given only those ids are considered."""
+
+        result = set()
+        for group in query.split('|'):
+            terms = tokenize(group)
+            if (not terms):
+                continue
+            ids = set(within) if within is not None else None
+            for term in sorted(terms, key = len, reverse = True):
+                ids = self.search_term(term) if ids is None else ids & self.search_term(term)
+                if (not ids):
+                    break
+            result |= ids
+        return result
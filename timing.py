@@ -0,0 +1,177 @@
+import collections
+import json
+import os
+import threading
+import time
+
+class Timings():
+    """Times operations and the phases they spend their time in, keeping the
+    latest durations of each operation for percentiles. Phases are timed
+    exclusively, a phase started inside another one pauses it. If a trace file
+    is opened every operation is also written to it as a chrome trace event,
+    which can be loaded in chrome://tracing or ui.perfetto.dev."""
+
+    def __init__(self, history = 256):
+        self.history = history
+        self.durations = {}
+        self.last = None
+        self.trace = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.epoch = time.perf_counter()
+
+
+    def open_trace(self, path):
+        """Starts writing events to a trace file."""
+
+        self.trace = open(path, 'w')
+        self.trace.write('[\n')
+        self.trace_started = False
+
+
+    def close_trace(self):
+        if (self.trace is not None):
+            self.trace.write('\n]\n')
+            self.trace.close()
+            self.trace = None
+
+
+    def measure(self, name, show = True, **args):
+        """Returns a context manager timing an operation. The phases timed on
+        the same thread while it runs are part of it. Unless show is False it
+        becomes the last operation, the one shown in the status bar."""
+
+        return Operation(self, name, show, args)
+
+
+    def phase(self, name):
+        """Returns a context manager timing a phase of the current operation."""
+
+        return Phase(self, name)
+
+
+    def iterate(self, iterable, name):
+        """Yields from an iterable, timing the time spent waiting on it as a phase."""
+
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                value = next(iterator, Phase)
+            if (value is Phase):
+                return
+            yield value
+
+
+    def record(self, operation):
+        with self.lock:
+            if (operation.name not in self.durations):
+                self.durations[operation.name] = collections.deque(maxlen = self.history)
+            self.durations[operation.name].append(operation.duration)
+            if (operation.show):
+                self.last = operation
+            if (self.trace is not None):
+                args = dict(operation.args)
+                args.update({phase: round(seconds * 1000, 3) for phase, seconds in operation.phases.items()})
+                event = {
+                    'name': operation.name,
+                    'ph': 'X',
+                    'ts': round((operation.start - self.epoch) * 1e6),
+                    'dur': round(operation.duration * 1e6),
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': args,
+                }
+                self.trace.write((',\n' if self.trace_started else '') + json.dumps(event))
+                self.trace_started = True
+
+
+    def percentiles(self, name, points = (50, 90, 99)):
+        """Returns the given percentiles of the latest durations of an
+        operation in seconds, or None if it never ran."""
+
+        with self.lock:
+            durations = sorted(self.durations.get(name, ()))
+        if (not durations):
+            return None
+        return [durations[min(len(durations) - 1, len(durations) * point // 100)] for point in points]
+
+
+    def format_last(self):
+        """Returns the breakdown of the last operation, with the percentiles of
+        its kind, like 'search 120ms: transfer 80 decode 30 | p50 110 p90 150'."""
+
+        operation = self.last
+        if (operation is None):
+            return ''
+        ms = lambda seconds: '%d' % round(seconds * 1000)
+        text = operation.name + ' ' + ms(operation.duration) + 'ms'
+        if (operation.phases):
+            text += ': ' + ' '.join(phase + ' ' + ms(seconds) for phase, seconds in operation.phases.items())
+        p50, p90 = self.percentiles(operation.name, (50, 90))
+        return text + ' | p50 ' + ms(p50) + ' p90 ' + ms(p90)
+
+
+class Operation():
+    def __init__(self, timings, name, show, args):
+        self.timings = timings
+        self.name = name
+        self.show = show
+        self.args = args
+        self.phases = {}
+
+
+    def __enter__(self):
+        local = self.timings.local
+        self.outer = getattr(local, 'operation', None)
+        if (self.outer is None):
+            local.operation = self
+            local.stack = []
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.duration = time.perf_counter() - self.start
+        if (self.timings.local.operation is self):
+            self.timings.local.operation = None
+        self.timings.record(self)
+
+
+class Phase():
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+
+    def charge(self, phase, now):
+        """Adds the time since phase last started running to the operation."""
+
+        phases = self.timings.local.operation.phases
+        phases[phase.name] = phases.get(phase.name, 0) + now - phase.start
+
+
+    def __enter__(self):
+        local = self.timings.local
+        self.active = getattr(local, 'operation', None) is not None
+        if (self.active):
+            now = time.perf_counter()
+            if (local.stack):
+                self.charge(local.stack[-1], now)
+            self.start = now
+            local.stack.append(self)
+        return self
+
+
+    def __exit__(self, *exc):
+        local = self.timings.local
+        # the operation may have ended in between, for a generator closed late
+        if (not self.active or getattr(local, 'operation', None) is None or self not in local.stack):
+            return
+        now = time.perf_counter()
+        self.charge(self, now)
+        local.stack.remove(self)
+        if (local.stack):
+            local.stack[-1].start = now
+
+
+timings = Timings()
@@ -4,9 +4,17 @@ import curses
 import math
 import os
 import pickle
+import sys
+import time
 from format import *
+from jobs import Workers
+from ordering import format_ordering, next_ordering, parse_ordering
 from page import *
+from pagememory import PageMemory
+from player import Player
 from query import *
+from screen import Screen
+from store import Store
 from video import *
 
 class Settings():
@@ -27,6 +35,33 @@ class Settings():
         self.simple_video_format = True
         self.player = 'mpv'
         self.player_args = '--no-terminal --volume=20'
+        # keep one mpv running and send it videos over its ipc socket, turn
+        # off for players that are not mpv
+        self.player_ipc = True
+        self.refresh_workers = 8
+        self.refresh_timeout = 10
+        # seconds a search waits on the network before giving up, so stalled
+        # searches do not hold the workers other jobs need
+        self.search_timeout = 10
+        self.max_connections = 8
+        # requests per second, requests sent at once after a quiet while and
+        # times a failed request is tried again
+        self.request_rate = 20
+        self.request_burst = 100
+        self.request_retries = 3
+        self.cache_size = 32 * 1024 * 1024
+        self.cache_user_ttl = 300
+        self.cache_search_ttl = 3600
+        self.offline = False
+        self.keep_library = True
+        self.api_base = 'https://gdata.youtube.com/feeds/api'
+        self.show_timings = False
+        # pages with at least this many videos keep them in columns, which
+        # takes far less memory, 0 never does
+        self.columnar_threshold = 20000
+        # bytes the videos of pages may take, the videos of the pages viewed
+        # longest ago are dropped from memory until loaded again, 0 keeps all
+        self.page_memory = 256 * 1024 * 1024
 
 
 class Ui():
@@ -37,6 +72,12 @@ class Ui():
         self.save_session = True
         self.pages = []
         self.next_message = ''
+        self.workers = Workers()
+        self.jobs = {}
+        self.store = Store(':memory:')
+        self.player = Player()
+        self.page_memory = PageMemory(self.store, self.settings.page_memory)
+        self.merged_at = time.monotonic()
         self.pages.append(SubscriptionPage('subscriptions'))
         self.pages.append(BookmarkPage('bookmarks'))
         if (not self.settings.open_searches_in_new_page):
@@ -46,10 +87,49 @@ class Ui():
             self.page_index = 1
 
 
+    def load_session(self, store):
+        """Restores the session saved in a store, or starts saving the current
+        one if the store is empty."""
+
+        self.store = store
+        self.page_memory.store = store
+        if (store.is_empty()):
+            store.save_session(self.pages, self.page_index, self.settings)
+            return
+        # only the open page is loaded with its videos, the others are loaded
+        # the first time they are shown
+        page_index = store.get_meta('page_index', 0)
+        self.pages = store.load_pages(page_classes, {page_index})
+        self.page_index = min(page_index, len(self.pages) - 1)
+        self.settings = store.get_meta('settings', self.settings)
+        self.fill_settings()
+        self.hydrate(self.pages[self.page_index])
+
+
+    def fill_settings(self):
+        """Gives settings saved by older versions the settings added since."""
+
+        for attr, value in vars(Settings()).items():
+            if (not hasattr(self.settings, attr)):
+                setattr(self.settings, attr, value)
+
+
+    def import_session(self, path, store):
+        """Moves a session pickled by older versions into a store."""
+
+        self.pages, self.page_index, self.settings = pickle.load(open(path, 'rb'))
+        self.fill_settings()
+        for page in self.pages:
+            page.videos = [intern_video(video) for video in page.videos]
+            page.changed()
+        store.save_session(self.pages, self.page_index, self.settings)
+        os.rename(path, path + '.old')
+
+
     def run_ui(self):
         """Sets up the ncurses interface."""
 
-        self.screen = curses.initscr()
+        self.screen = Screen(curses.initscr())
         curses.noecho()
         curses.cbreak()
         curses.curs_set(0)
@@ -63,20 +143,119 @@ class Ui():
         self.settings.current_page_style = curses.color_pair(2)
         if (self.settings.bold_current_page):
                 self.settings.current_page_style = self.settings.current_page_style ^ curses.A_BOLD
+        self.apply_settings()
         self.draw_screen()
         self.loop()
 
 
+    def apply_settings(self):
+        """Passes settings on to the modules that use them."""
+
+        settings = self.settings
+        pool.resize(settings.max_connections)
+        scheduler.configure(settings.request_rate, settings.request_burst, settings.request_retries)
+        ttls = {'user': settings.cache_user_ttl, 'term': settings.cache_search_ttl}
+        cache.configure(settings.cache_size, ttls, settings.offline)
+        library.enabled = settings.keep_library
+        set_api_base(settings.api_base)
+        self.player.configure(settings.player, settings.player_args, settings.player_ipc)
+        self.page_memory.budget = settings.page_memory
+
+
+    def run_in_background(self, page, work, done, name = 'load', update = None, failed = None):
+        """Runs work for a page on a worker thread, replacing the page's job with
+        the same name. done is called with the result, update with partial
+        results and failed with the error if there is one, from the main loop."""
+
+        key = (id(page), name)
+        if (key in self.jobs):
+            self.jobs.pop(key)[1].cancel()
+        if (update is not None):
+            add = update
+            def update(result):
+                # partial results are not saved, done saves what it gets
+                page.dirty = True
+                add(result)
+                page.changed()
+        self.jobs[key] = (page, self.workers.submit(work, done, update, failed))
+
+
+    def cancel_jobs(self, page):
+        """Cancels every job of a page."""
+
+        for key, (job_page, job) in list(self.jobs.items()):
+            if (job_page is page):
+                del self.jobs[key]
+                job.cancel()
+
+
+    def is_loading(self, page):
+        return any(job_page is page for job_page, job in self.jobs.values())
+
+
+    def finish_jobs(self):
+        """Hands the results of finished jobs to their pages. Returns whether
+        there was any."""
+
+        events = self.workers.collect()
+        for job, value in events:
+            if (value is not None):
+                job.update(value)
+                continue
+            for key, (page, page_job) in list(self.jobs.items()):
+                if (page_job is job):
+                    del self.jobs[key]
+            if (job.error is not None):
+                if (job.failed is not None):
+                    job.failed(job.error)
+                self.next_message = 'error: ' + str(job.error)
+            else:
+                job.done(job.result)
+        return bool(events)
+
+
+    def hydrate(self, page):
+        """Loads the videos of a page if they were not loaded yet, and moves
+        them into columns once there are enough of them."""
+
+        if (not getattr(page, 'hydrated', True)):
+            with timings.measure('hydrate', videos = 0) as operation:
+                self.store.hydrate_page(page)
+                operation.args['videos'] = len(page.videos)
+        if (not self.is_loading(page)):
+            # results streamed in are appended to the list they started in
+            page.pack(self.settings.columnar_threshold)
+
+
     def draw_screen(self):
-        """Redraws the entire screen."""
-
-        h, w = self.screen.getmaxyx()
-        self.page_bar = curses.newwin(1, w + 2, h - 2, 0)
-        self.status_bar = curses.newwin(2, w + 2, h - 1, 0)
-        self.draw_main_window()
-        self.draw_page_bar()
-        self.draw_status_bar()
-        
+        """Redraws the entire screen. Only rows that changed are repainted."""
+
+        page = self.pages[self.page_index]
+        self.hydrate(page)
+        self.page_memory.viewed(page)
+        self.page_memory.evict(self.pages, lambda other: other is page or self.is_loading(other))
+        with timings.measure('draw', show = False):
+            self.screen.layout()
+            self.status_bar = self.screen.windows['status_bar']
+            with timings.phase('main'):
+                self.draw_main_window()
+            with timings.phase('bars'):
+                self.draw_page_bar()
+                self.draw_status_bar()
+            with timings.phase('flush'):
+                self.screen.flush()
+
+
+    def pending_input(self):
+        """Returns whether a key is waiting to be read, leaving it queued."""
+
+        self.status_bar.timeout(0)
+        c = self.status_bar.getch()
+        if (c == -1):
+            return False
+        curses.ungetch(c)
+        return True
+
 
     def draw_main_window(self):
         """Redraws the main window."""
@@ -87,7 +266,6 @@ class Ui():
         """Redraws the status bar."""
         
         if (self.next_message == ''):
-            h, w = self.screen.getmaxyx()
             page = self.pages[self.page_index]
             start = page.start
             end = page.end
@@ -107,11 +285,25 @@ class Ui():
                 status += page.type
                 if (not page.videos):
                     status = 'no results'
+            if (getattr(page, 'sort', None) and page.videos):
+                status += ', sorted by ' + format_ordering(page.sort)
+            if (self.is_loading(page)):
+                status = 'loading ' + page.format() + '...' if not page.videos else status + ' (loading more)'
         else:
             status = self.next_message
             self.next_message = ''
-        self.status_bar.addstr(0, 0, status)
-        self.status_bar.refresh()
+        h, w = self.status_bar.getmaxyx()
+        segments = [(0, status, 0)]
+        if (self.settings.show_timings):
+            right = timings.format_last()
+            draw = timings.percentiles('draw', (50, 90))
+            if (draw is not None):
+                right += ' | draw p50 %.1f p90 %.1f' % (draw[0] * 1000, draw[1] * 1000)
+        else:
+            right = cache.format() if cache.enabled() else ''
+        if (right):
+            segments.insert(0, (max(w - len(right) - 3, 0), right, 0))
+        self.screen.put('status_bar', 0, segments)
 
     
     def draw_page_bar(self):
@@ -119,8 +311,7 @@ class Ui():
 
         pages = self.pages
         current = self.page_index
-        panel = self.page_bar
-        h, w = panel.getmaxyx()
+        h, w = self.screen.windows['page_bar'].getmaxyx()
         left = '--'
         right = '--'
         current_page = pages[current].format()
@@ -141,16 +332,17 @@ class Ui():
             real_width += 2
         if (real_width < w - 1):
             right += '-'
-        panel.addstr(0, 0, left)
-        panel.addstr(current_page, self.settings.current_page_style)
-        panel.addstr(right)
-        panel.refresh()
+        current_start = get_real_width(left)
+        right_start = current_start + get_real_width(current_page)
+        segments = [(0, left, 0), (current_start, current_page, self.settings.current_page_style), (right_start, right, 0)]
+        self.screen.put('page_bar', 0, segments)
 
 
     def get_input(self, prompt):
         """Gets input for a search."""
 
         curses.echo()
+        self.status_bar.timeout(-1)
         self.status_bar.erase()
         self.status_bar.addstr(0, 0, prompt)
         curses.curs_set(1)
@@ -161,8 +353,46 @@ class Ui():
             s = ''
         curses.noecho()
         curses.curs_set(0)
+        self.screen.forget('status_bar')
         return s
     
+    def get_live_input(self, prompt, on_change):
+        """Gets input, calling on_change with the text after every key so the
+        main window can follow it."""
+
+        curses.curs_set(1)
+        self.status_bar.timeout(-1)
+        text = ''
+        on_change(text)
+        while True:
+            self.draw_main_window()
+            self.draw_page_bar()
+            self.screen.put('status_bar', 0, [(0, prompt + text, 0)])
+            self.screen.flush()
+            h, w = self.status_bar.getmaxyx()
+            self.status_bar.move(0, min(get_real_width(prompt + text), w - 1))
+            try:
+                c = self.status_bar.get_wch()
+            except KeyboardInterrupt:
+                c = '\x1b'
+            if (c in ('\n', '\r', curses.KEY_ENTER)):
+                break
+            elif (c == '\x1b'):
+                text = ''
+            elif (c in ('\x7f', '\b', curses.KEY_BACKSPACE)):
+                text = text[:-1]
+            elif (isinstance(c, str) and c.isprintable()):
+                text += c
+            else:
+                continue
+            on_change(text)
+            if (c == '\x1b'):
+                break
+        curses.curs_set(0)
+        self.screen.forget('status_bar')
+        return text
+
+
     def change_settings(self):
         s = self.get_input('set: ')
         attr, val = s.split('=')
@@ -175,6 +405,8 @@ class Ui():
             except NameError:
                 value = val
             setattr(self.settings, attr, value)
+            self.apply_settings()
+            self.store.set_meta('settings', self.settings)
             self.next_message = attr + ' set to ' + str(value)
 
     def open_new_page(self):
@@ -185,48 +417,116 @@ class Ui():
         new_page = SearchPage('search result')
         self.pages = pages[0:index + 1] + [new_page] + pages[index + 1:]
         self.page_index = max(self.page_index + 1, 2)
+        self.store.save_order(self.pages, self.page_index)
     
     def filter_videos(self):
-        videos = self.pages[self.page_index].videos
+        source = self.pages[self.page_index]
         self.open_new_page()
         page = self.pages[self.page_index]
-        term = self.get_input('filter term: ')
-        page.videos = list(filter(lambda video: term.lower() in video.title.lower() or term in video.description.lower() or term in video.user.lower(), videos))
-        page.term = term
+        page.sort = getattr(source, 'sort', None)
+        def update(term):
+            # adding letters or words can only narrow an and query
+            previous = getattr(page, 'term', None)
+            if (previous is not None and '|' not in term and term.startswith(previous)):
+                page.videos = source.filter(term, page.videos)
+            else:
+                page.videos = source.filter(term)
+            page.changed()
+            page.term = term
+            page.start = 0
+            page.dirty = True
+        page.term = term = self.get_live_input('filter term: ', update)
+        self.store.save_page(page)
 
     def page_down(self):
         page = self.pages[self.page_index]
+        if (page.type == 'search result' and page.wants_more() and not self.is_loading(page)):
+            stream = page.stream
+            count = len(page.videos)
+            def done(videos):
+                page.videos[count:] = videos
+                page.changed()
+                self.store.append_videos(page, videos)
+            def failed(error):
+                # the chunk is fetched again from its start, drop what came of it
+                del page.videos[count:]
+                page.changed()
+            timeout = self.settings.search_timeout
+            self.run_in_background(page, lambda job: stream.fetch_next(job, timeout), done, update = page.videos.append, failed = failed)
+        # end is only set when a frame is drawn, and frames are skipped
+        # while keys are held
+        page.fit(self.videos_per_page())
         new_start = page.end - 1
         if (new_start < len(page.videos)):
             page.start = new_start
+        page.fit(self.videos_per_page())
 
     def page_up(self):
         page = self.pages[self.page_index]
+        page.fit(self.videos_per_page())
         new_start = page.start * 2 - page.end + 1
         if (new_start > 0):
             page.start = new_start
         else:
             page.start = 0
+        page.fit(self.videos_per_page())
+
+    def videos_per_page(self):
+        h, w = self.screen.windows['main'].getmaxyx()
+        return h // (2 if self.settings.simple_video_format else 3)
 
     def close_page(self):
         index = self.page_index
         pages = self.pages
         if (index > 1):
+            self.cancel_jobs(pages[index])
+            self.store.delete_page(pages[index])
             self.pages = pages[0:index] + pages[index + 1:]
             if (self.page_index >= len(self.pages)):
                     self.page_index -= 1
+            self.store.save_order(self.pages, self.page_index)
 
     def page_left(self):
         self.page_index = max(0, self.page_index - 1)
+        self.hydrate(self.pages[self.page_index])
+        self.store.set_meta('page_index', self.page_index)
 
     def page_right(self):
         pages = self.pages
         self.page_index = min(len(pages) - 1, self.page_index + 1)
+        self.hydrate(self.pages[self.page_index])
+        self.store.set_meta('page_index', self.page_index)
 
     def refresh_subs(self):
         page = self.pages[self.page_index]
-        if (page.type == 'subscriptions'):
-            page.refresh_subs(self.settings.max_results)
+        if (page.type == 'subscriptions' and not self.is_loading(page)):
+            settings = self.settings
+            self.merge_prefetched()
+            def done(result):
+                feeds, failed = result
+                with self.store.locked():
+                    added, removed = page.merge_subs(feeds, settings.max_results)
+                    self.store.save_merged(page, added, removed)
+                if (failed):
+                    self.next_message = 'could not refresh: ' + ', '.join(failed)
+            # the page is only read on this thread, the job gets a copy
+            snapshot = page.snapshot()
+            work = lambda job: page.fetch_subs(settings.max_results, settings.refresh_workers, settings.refresh_timeout, snapshot)
+            self.run_in_background(page, work, done)
+
+    def merge_prefetched(self):
+        """Merges the uploads fetched by daemon.py into the subscriptions."""
+
+        page = self.pages[0]
+        self.merged_at = time.monotonic()
+        with self.store.locked():
+            feeds = self.store.load_prefetched(take = True)
+            if (feeds):
+                self.hydrate(page)
+                added, removed = page.merge_subs(feeds, self.settings.max_results)
+                self.store.save_merged(page, added, removed)
+        return feeds
+
 
     def do_search(self, user = False):
         index = self.page_index
@@ -238,11 +538,54 @@ class Ui():
             return
         if (self.settings.open_searches_in_new_page):
             self.open_new_page()
+        page = self.pages[self.page_index]
         if (user):
             user, term = (s.split('/')[0], s.split('/')[1]) if '/' in s else (s, '')
-            self.pages[self.page_index].add_search(user, term, self.settings.user_order, self.settings.max_results)
+            page.set_search(user, term, self.settings.user_order, self.settings.max_results)
         else:
-            self.pages[self.page_index].add_search('', s, self.settings.search_order, self.settings.max_results)
+            page.set_search('', s, self.settings.search_order, self.settings.max_results)
+        stream = page.stream
+        def done(videos):
+            page.videos = videos
+            page.changed()
+            self.store.save_page(page)
+        def failed(error):
+            del page.videos[:]
+            page.changed()
+        timeout = self.settings.search_timeout
+        self.run_in_background(page, lambda job: stream.fetch_next(job, timeout), done, update = page.videos.append, failed = failed)
+
+    def local_search(self):
+        """Searches the library of videos seen before, without a request."""
+
+        index = self.page_index
+        if (index < 2 and not self.settings.open_searches_in_new_page):
+            return
+        s = self.get_input('local search: ')
+        if (s == ''):
+            return
+        if (self.settings.open_searches_in_new_page):
+            self.open_new_page()
+        page = self.pages[self.page_index]
+        self.cancel_jobs(page)
+        page.set_local(s, library.search(s))
+        self.store.save_page(page)
+
+    def subscribe(self, user, videos):
+        """Adds a user to the subscriptions, with videos being the user's
+        newest uploads if they were already fetched."""
+
+        page = self.pages[0]
+        self.hydrate(page)
+        page.add_user(user)
+        with self.store.locked():
+            if (videos):
+                added, removed = page.merge_subs({user: videos}, self.settings.max_results)
+                self.store.save_merged(page, added, removed)
+            else:
+                self.store.save_state(page)
+        self.next_message = 'user ' + user + ' added to subscriptions'
+
 
     def add_user(self):
         index = self.page_index
@@ -251,12 +594,14 @@ class Ui():
             s = self.get_input("add user: ")
             if (s == ''):
                 return
-            videos = search_user(s, '', self.settings.user_order, self.settings.max_results)
-            if (videos):
-                page.add_user(s)
-                self.next_message = 'user ' + s + ' added to subscriptions'
-            else:
-                self.next_message = 'no results found for user ' + s
+            def done(videos):
+                if (videos):
+                    self.subscribe(s, videos)
+                else:
+                    self.next_message = 'no results found for user ' + s
+            # fetched like a refresh would, so that it is the first refresh
+            work = lambda job: search_user(s, '', 'published', self.settings.max_results, self.settings.search_timeout)
+            self.run_in_background(page, work, done, 'add user ' + s)
         elif (index == 1):
             return
         else:
@@ -265,12 +610,75 @@ class Ui():
             else:
                 s = page.user
                 if (page.videos):
-                    self.pages[0].add_user(s)
-                    self.next_message = 'user ' + s + ' added to subscriptions'
+                    # the newest uploads are what a refresh would fetch
+                    newest = page.term == '' and page.ordering == 'published'
+                    self.subscribe(s, page.videos[:self.settings.max_results] if newest else [])
                 else:
                     self.next_message = 'no results found for user ' + s
 
 
+    def sort_page(self, ordering):
+        """Shows the current page sorted by an ordering, or in its own order
+        if it is None, without fetching anything."""
+
+        page = self.pages[self.page_index]
+        page.sort = ordering
+        page.start = 0
+        self.store.save_state(page)
+        self.next_message = 'sorted by ' + format_ordering(ordering) if ordering else 'page order'
+
+
+    def edit_bookmarks(self, page, start, end, command):
+        """Moves the bookmarks from start to end up or down by one or to the top,
+        or deletes them, saving only the ones that changed."""
+
+        if (getattr(page, 'sort', None) is not None):
+            if (command == 'd'):
+                deleted = page.view()[start:end]
+                for video in deleted:
+                    page.delete(video)
+                self.store.delete_videos(page, deleted)
+            elif (command in 'jkt'):
+                self.next_message = 'bookmarks can only be moved in their own order, press o to get back to it'
+            return
+        if (command == 'd'):
+            self.store.delete_videos(page, page.delete_range(start, end))
+            return
+        if (end - start == 1 and command in 'jk'):
+            changes = page.swap(page.videos[start], 1 if command == 'j' else -1)
+        elif (command == 'k' and start > 0):
+            changes = page.move_range(start, end, start - 1)
+        elif (command == 'j' and end < len(page.videos)):
+            changes = page.move_range(start, end, start + 1)
+        elif (command == 't'):
+            changes = page.move_range(start, end, 0)
+        else:
+            return
+        self.store.save_ranks(page, changes)
+
+
+    def play(self, videos, append = False):
+        """Plays videos in the player, after what is playing if append is set."""
+
+        try:
+            self.player.play([video.url() for video in videos], append)
+        except (OSError, RuntimeError) as e:
+            self.next_message = 'could not play: ' + str(e)
+            return False
+        return True
+
+
+    def play_bookmarks(self):
+        """Plays the whole bookmarks page as one playlist."""
+
+        self.hydrate(self.pages[1])
+        videos = self.pages[1].videos
+        if (not videos):
+            self.next_message = 'no bookmarks to play'
+        elif (self.play(videos)):
+            self.next_message = 'playing ' + str(len(videos)) + ' bookmarks'
+
+
     def loop(self):
         """The main loop of the UI."""
     
@@ -280,8 +688,15 @@ class Ui():
             page = pages[index]
             start = page.start
             end = page.end
+            self.status_bar.timeout(100)
             c = self.status_bar.getch()
-            if (c == ord('q')):
+            if (c == -1):
+                # pick up what daemon.py fetched while the ui is open
+                merged = time.monotonic() - self.merged_at > 60 and self.merge_prefetched()
+                if (self.finish_jobs() or merged):
+                    self.draw_screen()
+                continue
+            elif (c == ord('q')):
                 break
             elif (c == ord('j')):
                 self.page_down()
@@ -299,6 +714,8 @@ class Ui():
                 self.refresh_subs()
             elif (c == ord('/') or c == ord('.') or c == ord(' ')):
                 self.do_search()
+            elif (c == ord('L')):
+                self.local_search()
             elif (c == ord('u')):
                 self.do_search(user = True)
             elif (c == ord('s')):
@@ -307,48 +724,82 @@ class Ui():
                 self.filter_videos()
             elif (c == ord('c')):
                 self.change_settings()
+            elif (c == ord('P')):
+                self.play_bookmarks()
+            elif (c == ord('o')):
+                self.sort_page(next_ordering(getattr(page, 'sort', None)))
+            elif (c == ord('O')):
+                text = self.get_input('sort by: ')
+                try:
+                    self.sort_page(parse_ordering(text))
+                except ValueError as e:
+                    self.next_message = str(e)
+            elif (c == ord('M')):
+                self.next_message = self.page_memory.report(self.pages)
+            elif (c == ord('T')):
+                self.settings.show_timings = not self.settings.show_timings
             elif (c >= ord('0') and c <= ord('9')):
                 input = chr(c)
                 while True:
                     n = self.status_bar.getch()
+                    if (n == -1):
+                        continue
                     input += chr(n)
-                    if (n < ord('0') or n > ord('9')):
+                    # a - makes a range of videos, like 3-7d
+                    if ((n < ord('0') or n > ord('9')) and not (n == ord('-') and '-' not in input[:-1])):
                         break
-                num = int(input[:-1])
                 command = input[-1:]
-                video_index = num - 1 if self.settings.show_real_index else num + page.start
-                if (video_index >= len(page.videos)):
+                first, dash, last = input[:-1].partition('-')
+                if (not last.isdigit()):
+                    last = first
+                video_index = int(first) - 1 if self.settings.show_real_index else int(first) + page.start
+                last_index = int(last) - 1 if self.settings.show_real_index else int(last) + page.start
+                if (video_index >= len(page.videos) or last_index >= len(page.videos) or last_index < video_index):
                     self.next_message = 'selection index out of range'
                     continue
-                video = page.videos[video_index]
+                video = page.view()[video_index]
+                videos = page.view()[video_index:last_index + 1]
                 if (command == 'p'):
-                    self.status_bar.clear()
-                    self.next_message = 'playing: ' + video.title
-                    video.play(self.settings.player, self.settings.player_args)
+                    if (self.play(videos)):
+                        self.next_message = 'playing: ' + video.title
+                elif (command == 'a'):
+                    if (self.play(videos, append = True)):
+                        self.next_message = 'queued: ' + video.title
                 elif (command == 'b'):
-                    self.pages[1].add_bookmark(video)
-                    self.next_message = '"' + video.title + '" added to bookmarks'
+                    self.hydrate(self.pages[1])
+                    rank = self.pages[1].add_bookmark(video)
+                    if (rank is None):
+                        self.next_message = '"' + video.title + '" is already bookmarked'
+                    else:
+                        self.store.save_ranks(self.pages[1], [(video, rank)])
+                        self.next_message = '"' + video.title + '" added to bookmarks'
                 elif (page.type == 'bookmarks'):
-                    if (command == 'k'):
-                        page.swap(video, -1)
-                    elif (command == 'j'):
-                        page.swap(video, 1)
-                    elif (command == 'd'):
-                        page.delete(video) 
-            self.draw_screen()
+                    self.edit_bookmarks(page, video_index, last_index + 1, command)
+            # let held keys catch up before painting a frame
+            if (not self.pending_input()):
+                self.draw_screen()
 
 
 if (__name__ == '__main__'):
+    # python3 ui.py --trace file writes the timed operations as a chrome trace
+    if ('--trace' in sys.argv[1:-1]):
+        timings.open_trace(sys.argv[sys.argv.index('--trace') + 1])
     try:
         ui = Ui()
         if (ui.save_session):
-            if (os.path.isfile('session')):
-                ui.pages, ui.page_index, ui.settings = pickle.load(open('session', 'rb'))
-            else:
-                open('session', 'a').close()
+            store = Store()
+            with timings.measure('session load'):
+                if (os.path.isfile('session') and store.is_empty()):
+                    ui.import_session('session', store)
+                ui.load_session(store)
+                ui.merge_prefetched()
             ui.run_ui()
-            pickle.dump((ui.pages, ui.page_index, ui.settings), open('session', 'wb'))
+            with timings.measure('session save'), store.locked():
+                store.save_states(ui.pages)
+                store.save_order(ui.pages, ui.page_index)
         else:
             ui.run_ui()
+        ui.player.close()
     finally:
         curses.endwin()
+        timings.close_trace()
@@ -1,24 +1,127 @@
 #!/usr/bin/env python
 
-import subprocess
+import calendar
+import sys
+import threading
 import time
+import weakref
 from format import *
 
+def parse_time(timestamp):
+    """Converts an ISO 8601 UTC timestamp like 2013-05-10T14:31:25.000Z to
+    seconds since the epoch, much faster than time.strptime."""
+
+    year = int(timestamp[0:4])
+    month = int(timestamp[5:7])
+    day = int(timestamp[8:10])
+    # days since 1970-01-01 in the proleptic gregorian calendar
+    if (month <= 2):
+        year -= 1
+        month += 12
+    days = 365 * year + year // 4 - year // 100 + year // 400 + (153 * (month - 3) + 2) // 5 + day - 719469
+    return days * 86400 + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+
+def parse_int(value):
+    return int(value) if value is not None else 0
+
+
 class Video():
-    """ Class to represent a Youtube video."""
+    """ Class to represent a Youtube video. Fields that are rarely needed are
+    kept as received and parsed the first time they are used."""
+
+    __slots__ = ('id', 'title', 'user', 'uploaded', 'length', 'raw',
+                 'description', 'views', 'rating', 'likes', 'dislikes', 'comment_count', '__weakref__')
+
+    # counts the videos updated in place, so formatted rows can be dropped
+    updates = 0
+
+    # raw holds these keys of the received data, in this order
+    raw_keys = ('description', 'viewCount', 'rating', 'likeCount', 'ratingCount', 'commentCount')
+
+    lazy_fields = {
+        'description': lambda raw: raw[0],
+        'views': lambda raw: parse_int(raw[1]),
+        'rating': lambda raw: float(raw[2]) if raw[2] is not None else 0,
+        'likes': lambda raw: parse_int(raw[3]),
+        'dislikes': lambda raw: parse_int(raw[4]) - parse_int(raw[3]) if raw[4] is not None else 0,
+        'comment_count': lambda raw: parse_int(raw[5]),
+    }
 
     def __init__(self, data):
         self.id = data['id']
         self.title = data['title']
-        self.description = data['description']
         self.user = data['uploader']
-        self.uploaded = time.strptime(data['uploaded'].replace(".000Z", "").replace("T", " "), "%Y-%m-%d %H:%M:%S")
-        self.views = int(data['viewCount']) if 'viewCount' in data else 0
-        self.rating = float(data['rating']) if 'rating' in data else 0
-        self.likes = int(data['likeCount']) if 'likeCount' in data else 0
-        self.dislikes = int(data['ratingCount']) - self.likes if 'ratingCount' in data else 0
-        self.comment_count = int(data['commentCount']) if 'commentCount' in data else 0
+        self.uploaded = parse_time(data['uploaded'])
         self.length = int(data['duration'])
+        self.raw = Video.get_raw(data)
+
+
+    @staticmethod
+    def get_raw(data):
+        get = data.get
+        return (data['description'], get('viewCount'), get('rating'), get('likeCount'), get('ratingCount'), get('commentCount'))
+
+
+    def update(self, data):
+        """Updates the title, description and counts of the video in place
+        from newer data."""
+
+        title = data['title']
+        raw = Video.get_raw(data)
+        if (title == self.title and raw == self.raw):
+            return
+        self.title = title
+        self.raw = raw
+        # parsed again from raw on their next use
+        for name in Video.lazy_fields:
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+        Video.updates += 1
+
+
+    def __getattr__(self, name):
+        """Parses a lazy field on first access."""
+
+        parse = Video.lazy_fields.get(name)
+        if (parse is None):
+            raise AttributeError(name)
+        value = parse(self.raw)
+        setattr(self, name, value)
+        return value
+
+
+    def __setstate__(self, state):
+        """Restores videos pickled by older versions, which had a __dict__ and a
+        struct_time upload date."""
+
+        if (isinstance(state, tuple)):
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+        if (isinstance(self.uploaded, time.struct_time)):
+            self.uploaded = calendar.timegm(self.uploaded)
+        if (not hasattr(self, 'raw')):
+            self.raw = (self.description, self.views, self.rating, self.likes, self.likes + self.dislikes, self.comment_count)
+
+
+    def to_data(self):
+        """Returns the video in the form it is received in, so that it can be
+        saved and recreated with Video(data)."""
+
+        data = {
+            'id': self.id,
+            'title': self.title,
+            'uploader': self.user,
+            'uploaded': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(self.uploaded)),
+            'duration': self.length,
+        }
+        for key, value in zip(Video.raw_keys, self.raw):
+            if (value is not None):
+                data[key] = value
+        return data
 
 
     def format_title_desc(self, number):
@@ -40,13 +143,44 @@ class Video():
                 ' d:' + format_int(self.dislikes, 4) + \
                 ' r:' + quick_fit_string(str(self.rating), 4)
         info3 = ' r:' + quick_fit_string(str(self.rating), 4) + \
-                ' u:' + time.strftime('%d/%m/%y', self.uploaded)
+                ' u:' + time.strftime('%d/%m/%y', time.gmtime(self.uploaded))
         return (user, info1, info3)
 
 
-    def play(self, player, args):
-        """Opens the video in a video player"""
+    def size(self):
+        """Returns an estimate of the bytes the video takes in memory, with the
+        strings only it uses."""
+
+        size = sys.getsizeof(self) + sys.getsizeof(self.id) + sys.getsizeof(self.title) + sys.getsizeof(self.raw)
+        return size + sum(sys.getsizeof(value) for value in self.raw if value is not None)
+
+
+    def url(self):
+        """Returns the url of the video's page, which players can open."""
+
+        return 'https://www.youtube.com/watch?v=' + self.id
+
+
+# every video in use by id, so that a video on several pages is one object
+known_videos = weakref.WeakValueDictionary()
+known_videos_lock = threading.Lock()
+
+def intern_video(video):
+    """Returns the video in use with the same id, or makes this one the
+    video in use for its id."""
+
+    with known_videos_lock:
+        return known_videos.setdefault(video.id, video)
+
 
-        url = 'https://www.youtube.com/watch?v=' + self.id
-        player = subprocess.Popen([player] + args.split(' ') +  [url], stderr=subprocess.DEVNULL)
+def make_video(data, update = True):
+    """Returns the video for received data. If the video is in use it is
+    returned with its counts updated, unless update is False because the
+    data may be older."""
 
+    video = known_videos.get(data['id'])
+    if (video is None):
+        return intern_video(Video(data))
+    if (update):
+        video.update(data)
+    return video